@@ -0,0 +1,88 @@
+"""
+Benchmark choosing the map zoom level for an alert salvo.
+
+Compares the old pairwise haversine search for the largest distance between alerted cities with
+the bounding-box fit used by get_map_url now. Run from the repository root:
+
+    python benchmarks/map_zoom.py [salvo sizes...]
+"""
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from geodata import GeoData  # noqa: E402
+from map_renderer import bounds_center, bounds_zoom  # noqa: E402
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+
+def haversine_distance(coord1, coord2):
+    R = 6371000  # Radius of the Earth in meters
+    lat1, lon1 = math.radians(coord1[0]), math.radians(coord1[1])
+    lat2, lon2 = math.radians(coord2[0]), math.radians(coord2[1])
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = math.sin(dlat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    return R * c
+
+
+def pairwise_zoom(all_coords):
+    """The previous zoom selection: the largest distance between any two cities."""
+    max_distance = 0
+    for i in range(len(all_coords)):
+        for j in range(i + 1, len(all_coords)):
+            max_distance = max(max_distance, haversine_distance(all_coords[i], all_coords[j]))
+    if max_distance < 5000:
+        return 12
+    elif max_distance < 15000:
+        return 11
+    return -1
+
+
+def bounding_box_zoom(geodata, all_coords, areas):
+    """The current zoom and center selection from the box around the cities and areas."""
+    bounds = geodata.map_bounds(all_coords, areas)
+    return bounds_zoom(bounds, 800, 400, 40, max_zoom=12), bounds_center(bounds)
+
+
+def timed(function, *args, repeat=3):
+    """Best wall time of a few runs, in milliseconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main(sizes):
+    geodata = GeoData({
+        "targets": os.path.join(DATA_DIR, "targets.json"),
+        "area_to_polygon": os.path.join(DATA_DIR, "area_to_polygon.json"),
+        "area_to_coordinates": os.path.join(DATA_DIR, "area_to_coordinates.json"),
+        "locality_residents": os.path.join(DATA_DIR, "locality_residents.json"),
+        "population_table": os.path.join(DATA_DIR, "population_table.json"),
+        "packed_geometry": os.path.join(DATA_DIR, "area_geometry.bin"),
+    })
+    cities = [(city_he, record["coordinates"][city_he]) for city_he, record in geodata.city_index.items()
+              if record["coordinates"].get(city_he, {}).get("lat") is not None]
+    random.seed(0)
+
+    print(f"{'cities':>8} {'pairwise ms':>12} {'bounding box ms':>16} {'speedup':>9}")
+    for size in sizes:
+        salvo = random.sample(cities, min(size, len(cities)))
+        all_coords = [(coord["lat"], coord["lng"]) for _, coord in salvo]
+        areas = [city_he for city_he, _ in salvo]  # Alerted areas are outlined by their city polygons
+        geodata.map_bounds(all_coords, areas)  # Fill the per-area box cache, as the running bot would have
+        old = timed(pairwise_zoom, all_coords)
+        new = timed(bounding_box_zoom, geodata, all_coords, areas)
+        print(f"{size:>8} {old:>12.2f} {new:>16.3f} {old / new:>8.0f}x")
+
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1:]] or [10, 50, 100, 400, 1000])
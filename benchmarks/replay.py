@@ -0,0 +1,452 @@
+"""
+End-to-end load benchmark that replays alert streams against a fake Discord.
+
+Alerts go through the bot's own pipeline: the ingest queue, handle_alert, the update scheduler,
+the map image cache, the outbound queue and send_embed. Only the outside world is replaced:
+channels are in-process fakes that answer sends and edits after a simulated HTTP delay, and map
+images come from a local HTTP server standing in for Google Static Maps. The bot runs in a
+temporary directory with a generated config.json, so nothing of the real setup is touched.
+
+The stream is either a recorded file or a synthetic barrage. Recorded files hold alerts in the
+oref format of resources/example.json ({"id", "cat", "title", "data", "desc"}, timed by an
+optional "time" or "alertDate") or tzevaadom WebSocket frames ({"type": "ALERT", "data": {...}}),
+as one JSON object, a JSON list or JSON lines. They are replayed with their recorded spacing
+divided by --speedup.
+
+A city counts as delivered to a channel when a message in that channel first lists it, or counts
+it in the "...and N more alerts" line. The report has the alerts handled per second, the
+delivery latency percentiles per channel, the time spent in each pipeline stage and the peak
+memory. Run from the repository root:
+
+    python benchmarks/replay.py                                # 500 cities in 10 s to 50 channels
+    python benchmarks/replay.py --scenario salvo
+    python benchmarks/replay.py --replay resources/example.json --channels 10
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from urllib.parse import urlsplit
+
+import aiohttp
+from aiohttp import web
+from PIL import Image
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC_DIR)
+
+from alert_sources import normalize_oref, normalize_tzevaadom  # noqa: E402
+from alert_window import AlertWindow  # noqa: E402
+from ingest import json_loads  # noqa: E402
+
+# Synthetic streams: cities alerted, seconds they are spread over, channels, cities per alert
+SCENARIOS = {
+    "barrage": {"cities": 500, "duration": 10.0, "channels": 50, "alert_size": 25},
+    "salvo": {"cities": 60, "duration": 3.0, "channels": 10, "alert_size": 10},
+    "sustained": {"cities": 300, "duration": 60.0, "channels": 20, "alert_size": 5},
+}
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a sorted list."""
+    if not values:
+        return float("nan")
+    return values[min(len(values) - 1, max(0, round(q / 100 * len(values)) - 1))]
+
+
+def parse_description(description):
+    """Return the lines listed in an alert description and how many more cities it counts without listing."""
+    locations = description.split("```", 2)[1] if description.count("```") >= 2 else ""
+    listed, more = [], 0
+    for line in locations.split("\n"):
+        line = line.removeprefix("• ")
+        if line.startswith("...and ") and line.endswith(" more alerts."):
+            more = int(line.split()[1])
+        elif line and not line.startswith("..."):
+            listed.append(line)
+    return listed, more
+
+
+class DeliveryTracker:
+    """Records when each alerted city first reaches each channel."""
+
+    def __init__(self):
+        self.accepted = []  # (description line, received_at) of every city added to the alert window, in order
+        self.positions = {}  # description line -> positions in accepted, cities can share an English name
+        self.delivered = {}  # channel id -> position in accepted up to which the channel has been told
+        self.latencies = {}  # channel id -> delivery latency of each city, in seconds
+
+    def accept(self, line, received_at):
+        self.positions.setdefault(line, []).append(len(self.accepted))
+        self.accepted.append((line, received_at))
+
+    def find(self, listed):
+        """Position in accepted where the listed lines start, or None."""
+        # The window lists its cities oldest first, in the order they arrived
+        for start in reversed(self.positions.get(listed[0], [])):
+            if [line for line, _ in self.accepted[start:start + len(listed)]] == listed:
+                return start
+        return None
+
+    def deliver(self, channel_id, description, now):
+        listed, more = parse_description(description)
+        start = self.find(listed) if listed else None
+        if start is None:
+            return
+        end = min(len(self.accepted), start + len(listed) + more)
+        latencies = self.latencies.setdefault(channel_id, [])
+        for _, received_at in self.accepted[max(start, self.delivered.get(channel_id, 0)):end]:
+            latencies.append(now - received_at)
+        self.delivered[channel_id] = max(end, self.delivered.get(channel_id, 0))
+
+
+class FakeMessage:
+    def __init__(self, channel):
+        self.channel = channel
+        self.id = channel.messages
+
+    async def edit(self, embed=None, attachments=None, **kwargs):
+        await self.channel.request("edit", embed, attachments[0] if attachments else None)
+        return self
+
+
+class FakeChannel:
+    """A Discord text channel answering sends and edits after a simulated HTTP round trip."""
+
+    def __init__(self, channel_id, tracker, latency, rng):
+        self.id = channel_id
+        self.name = f"bench-{channel_id}"
+        self.tracker = tracker
+        self.latency = latency
+        self.rng = rng
+        self.messages = 0
+        self.edits = 0
+        self.uploaded = 0
+
+    async def request(self, kind, embed, file):
+        await asyncio.sleep(self.latency * self.rng.uniform(0.5, 1.5))
+        if file is not None:
+            self.uploaded += file.fp.seek(0, io.SEEK_END)
+        if kind == "edit":
+            self.edits += 1
+        else:
+            self.messages += 1
+        if embed is not None and embed.description:
+            self.tracker.deliver(self.id, embed.description, time.time())
+
+    async def send(self, content=None, embed=None, file=None, **kwargs):
+        await self.request("send", embed, file)
+        return FakeMessage(self)
+
+
+class FakeMapsServer:
+    """Local stand-in for Google Static Maps, answering every map URL with the same PNG."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.requests = 0
+        noise = Image.effect_noise((800, 400), 40).convert("RGB")  # Compresses about as badly as a real map
+        buffer = io.BytesIO()
+        noise.save(buffer, format="PNG")
+        self.image = buffer.getvalue()
+        self.runner = None
+        self.base_url = None
+
+    async def handle(self, request):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        return web.Response(body=self.image, content_type="image/png")
+
+    async def start(self):
+        # Map URLs run up to 8 KB, longer than aiohttp accepts by default
+        app = web.Application(handler_args={"max_line_size": 32768, "max_field_size": 32768})
+        app.router.add_get("/{path:.*}", self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{port}"
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+class RedirectingSession:
+    """Sends the bot's HTTP requests to the fake maps server instead of their real host."""
+
+    def __init__(self, session, base_url):
+        self.session = session
+        self.base_url = base_url
+
+    def get(self, url, **kwargs):
+        parts = urlsplit(url)
+        return self.session.get(f"{self.base_url}{parts.path}?{parts.query}", **kwargs)
+
+
+def frame_time(item):
+    """Recorded time of an alert in seconds, or None if it has none."""
+    data = item.get("data")
+    if isinstance(data, dict) and isinstance(data.get("time"), (int, float)):
+        return data["time"]
+    if isinstance(item.get("time"), (int, float)):
+        return item["time"]
+    if item.get("alertDate"):
+        return datetime.fromisoformat(item["alertDate"]).timestamp()
+    return None
+
+
+def load_recording(path):
+    """Return [(offset seconds, source, frame text)] from a recorded oref or tzevaadom stream."""
+    with open(path, encoding="utf-8-sig") as file:
+        text = file.read().strip()
+    try:
+        items = json.loads(text)
+    except ValueError:
+        items = [json.loads(line) for line in text.splitlines() if line.strip()]
+    if isinstance(items, dict):
+        items = [items]
+
+    stream, start, last = [], None, 0.0
+    for item in items:
+        recorded = frame_time(item)
+        if recorded is not None:
+            start = recorded if start is None else start
+            last = recorded - start
+        source = "websocket" if isinstance(item.get("data"), dict) else "oref"
+        stream.append((last, source, json.dumps(item, ensure_ascii=False)))  # Alerts without a time keep the last one
+    return stream
+
+
+def synthetic_stream(cities, count, duration, alert_size, rng):
+    """Return [(offset seconds, source, frame text)] of WebSocket frames alerting `count` cities over `duration`."""
+    chosen = rng.sample(cities, min(count, len(cities)))
+    alerts = []
+    while chosen:
+        size = rng.randint(1, alert_size)
+        alerts.append(chosen[:size])
+        chosen = chosen[size:]
+    offsets = sorted(rng.uniform(0, duration) for _ in alerts)
+    offsets[0] = 0.0
+    now = int(time.time())
+    stream = []
+    for number, (offset, alert_cities) in enumerate(zip(offsets, alerts)):
+        frame = {"type": "ALERT", "data": {
+            "notificationId": f"bench_{now}_{number}", "time": now + int(offset), "threat": 0,
+            "isDrill": False, "cities": alert_cities,
+        }}
+        stream.append((offset, "websocket", json.dumps(frame, ensure_ascii=False)))
+    return stream
+
+
+def write_config(workdir, args):
+    """Write the config.json the bot loads on import, with every data file read from src/."""
+    config = {
+        "discord_token": "benchmark",
+        "google_maps_api_key": "benchmark",
+        "telegram_api_id": 0,
+        "telegram_api_hash": "benchmark",
+        "telegram_channel": "benchmark",
+        "channel_ids": [],
+        "metrics_port": None,
+        "update_tick": args.update_tick,
+        "delivery_concurrency": args.delivery_concurrency,
+        "data_files": {
+            "english_cities": os.path.join(SRC_DIR, "..", "data", "englishCities.json"),
+            "targets": os.path.join(SRC_DIR, "targets.json"),
+            "area_to_polygon": os.path.join(SRC_DIR, "area_to_polygon.json"),
+            "area_to_coordinates": os.path.join(SRC_DIR, "area_to_coordinates.json"),
+            "locality_residents": os.path.join(SRC_DIR, "locality_residents.json"),
+            "population_table": os.path.join(SRC_DIR, "population_table.json"),
+            "packed_geometry": os.path.join(SRC_DIR, "area_geometry.bin"),
+            "alert_history": os.path.join(workdir, "alert_history.db"),
+            "posted_alert_ids": os.path.join(workdir, "posted_alert_ids.json"),
+        },
+    }
+    with open(os.path.join(workdir, "config.json"), "w") as file:
+        json.dump(config, file)
+
+
+async def replay(bot, stream, args):
+    """Replay the stream through the bot and return the measurements."""
+    rng = random.Random(args.seed)
+    tracker = DeliveryTracker()
+    maps = FakeMapsServer(args.maps_latency)
+    await maps.start()
+    channels = [FakeChannel(channel_id, tracker, args.discord_latency, rng) for channel_id in range(1, args.channels + 1)]
+
+    async with aiohttp.ClientSession() as session:
+        bot.bot.session = RedirectingSession(session, maps.base_url)
+        alert = bot.get_red_alert()
+        await asyncio.to_thread(alert.geodata.warm_path_cache)  # As on_ready does before alerts arrive
+
+        # Note which cities each alert adds to the window, and when that alert was received
+        handle_alert = bot.handle_alert
+        window_add = bot.recent_alerts.add
+        current = {}
+        handled = []
+
+        async def tracked_handle_alert(alert_data, alert, channels, received_at=None):
+            current["received_at"] = received_at
+            try:
+                await handle_alert(alert_data, alert, channels, received_at)
+            finally:
+                handled.append(time.time())
+
+        def tracked_add(entry, population=0, area=None):
+            window_add(entry, population, area)
+            tracker.accept(AlertWindow.line(entry), current["received_at"])
+
+        bot.handle_alert = tracked_handle_alert
+        bot.recent_alerts.add = tracked_add
+        consumer = asyncio.get_running_loop().create_task(bot.process_alerts(alert, channels))
+
+        if args.tracemalloc:
+            tracemalloc.start()
+        skipped = 0
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        started_at = time.time()
+        for offset, source, frame in stream:
+            await asyncio.sleep(max(0.0, start + offset / args.speedup - loop.time()))
+            received_at = time.time()
+            if source == "websocket":
+                alert_data = normalize_tzevaadom(json_loads(frame))
+            else:
+                alert_data = normalize_oref(json_loads(frame), received_at)
+            if alert_data is None:
+                skipped += 1
+                continue
+            bot.alert_queue.put(alert_data, received_at)
+
+        while len(handled) + skipped + bot.alert_queue.dropped < len(stream):
+            await asyncio.sleep(0.01)
+        handled_at = time.time()
+        await bot.update_scheduler.drain()
+        finished_at = time.time()
+        traced_peak = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+        consumer.cancel()
+        await maps.stop()
+
+    return {
+        "tracker": tracker,
+        "channels": channels,
+        "alerts": len(handled),
+        "skipped": skipped,
+        "handling_seconds": handled_at - started_at,
+        "total_seconds": finished_at - started_at,
+        "maps_requests": maps.requests,
+        "traced_peak": traced_peak,
+    }
+
+
+def report(bot, args, stream, result, rss_before):
+    tracker = result["tracker"]
+    channels = result["channels"]
+    replayed = stream[-1][0] / args.speedup if stream else 0.0
+    print(f"Replayed {len(stream)} alerts ({result['skipped']} not alerts) over {replayed:.1f} s "
+          f"to {len(channels)} channels; {len(tracker.accepted)} cities entered the alert window")
+    print(f"Handled {result['alerts']} alerts in {result['handling_seconds']:.2f} s: "
+          f"{result['alerts'] / max(result['handling_seconds'], 1e-9):.1f} alerts/s, "
+          f"{len(tracker.accepted) / max(result['handling_seconds'], 1e-9):.1f} cities/s")
+    print(f"Every channel up to date after {result['total_seconds']:.2f} s")
+
+    complete = sum(1 for channel in channels if tracker.delivered.get(channel.id, 0) == len(tracker.accepted))
+    everything = sorted(latency for latencies in tracker.latencies.values() for latency in latencies)
+    print(f"\nDelivery latency per city and channel ({len(everything)} deliveries, "
+          f"{complete}/{len(channels)} channels received every city):")
+    rows = []
+    for channel in channels:
+        latencies = sorted(tracker.latencies.get(channel.id, []))
+        rows.append((channel.name, len(latencies), percentile(latencies, 50), percentile(latencies, 95),
+                     percentile(latencies, 99), latencies[-1] if latencies else float("nan"),
+                     channel.messages, channel.edits))
+    rows.sort(key=lambda row: row[4], reverse=True)
+    print(f"{'channel':<12} {'cities':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9} {'sends':>6} {'edits':>6}")
+    print(f"{'all':<12} {len(everything):>7} {percentile(everything, 50) * 1000:>9.0f} "
+          f"{percentile(everything, 95) * 1000:>9.0f} {percentile(everything, 99) * 1000:>9.0f} "
+          f"{(everything[-1] if everything else float('nan')) * 1000:>9.0f} "
+          f"{sum(c.messages for c in channels):>6} {sum(c.edits for c in channels):>6}")
+    for name, count, p50, p95, p99, worst, messages, edits in rows if args.per_channel else rows[:5]:
+        print(f"{name:<12} {count:>7} {p50 * 1000:>9.0f} {p95 * 1000:>9.0f} {p99 * 1000:>9.0f} "
+              f"{worst * 1000:>9.0f} {messages:>6} {edits:>6}")
+    if not args.per_channel and len(rows) > 5:
+        print(f"... {len(rows) - 5} faster channels not shown, use --per-channel")
+
+    print("\nPipeline stages:")
+    print(f"{'stage':<11} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for stage, count, p50, p95, p99 in bot.latency.summary():
+        print(f"{stage:<11} {count:>6} {p50 * 1000:>9.1f} {p95 * 1000:>9.1f} {p99 * 1000:>9.1f}")
+
+    updates = bot.update_scheduler.stats()
+    outbound = bot.outbound.stats()
+    print(f"\nUpdates: {updates['completed']} run, {updates['merged']} merged; "
+          f"outbound sent {sum(outbound['sent'].values())}, shed {sum(outbound['shed'].values())}; "
+          f"map requests {result['maps_requests']} (cache hits {bot.map_image_cache.hits}); "
+          f"uploaded {sum(c.uploaded for c in channels) / 1024 / 1024:.1f} MB")
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # kB on Linux
+    print(f"Peak RSS {peak_rss:.0f} MB ({peak_rss - rss_before:+.0f} MB during the replay)"
+          + (f", peak traced Python memory {result['traced_peak'] / 1024 / 1024:.1f} MB"
+             if result["traced_peak"] is not None else ""))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scenario", choices=SCENARIOS, default="barrage", help="synthetic stream preset")
+    parser.add_argument("--replay", help="recorded oref or tzevaadom stream to replay instead")
+    parser.add_argument("--cities", type=int, help="cities alerted by the synthetic stream")
+    parser.add_argument("--duration", type=float, help="seconds the synthetic stream is spread over")
+    parser.add_argument("--alert-size", type=int, help="most cities in one synthetic alert")
+    parser.add_argument("--channels", type=int, help="fake channels to deliver to")
+    parser.add_argument("--speedup", type=float, default=1.0, help="replay this many times faster than recorded")
+    parser.add_argument("--discord-latency", type=float, default=0.15, help="seconds per fake Discord request")
+    parser.add_argument("--maps-latency", type=float, default=0.3, help="seconds per fake map request")
+    parser.add_argument("--update-tick", type=float, default=1.0, help="update_tick of the bot")
+    parser.add_argument("--delivery-concurrency", type=int, default=10, help="delivery_concurrency of the bot")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--per-channel", action="store_true", help="show every channel")
+    parser.add_argument("--tracemalloc", action="store_true", help="also trace Python allocations (slower)")
+    parser.add_argument("--verbose", action="store_true", help="show the bot's output")
+    args = parser.parse_args()
+    for key, value in SCENARIOS[args.scenario].items():
+        if getattr(args, key) is None:
+            setattr(args, key, value)
+    recording = os.path.abspath(args.replay) if args.replay else None
+
+    with tempfile.TemporaryDirectory(prefix="redalert-bench-") as workdir:
+        write_config(workdir, args)
+        os.chdir(workdir)
+        with contextlib.redirect_stdout(sys.stdout if args.verbose else io.StringIO()):
+            import main as bot  # Loads config.json from the working directory
+        logging.getLogger().setLevel(logging.INFO if args.verbose else logging.ERROR)
+
+        rng = random.Random(args.seed)
+        if recording:
+            stream = load_recording(recording)
+        else:
+            bot.bot.session = None  # The alert pipeline gets its session in replay()
+            geodata = bot.get_red_alert().geodata
+            cities = [city_he for city_he, record in geodata.city_index.items() if record["coordinates"]]
+            stream = synthetic_stream(cities, args.cities, args.duration, args.alert_size, rng)
+
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        try:
+            with contextlib.redirect_stdout(sys.stdout if args.verbose else io.StringIO()):
+                result = asyncio.run(replay(bot, stream, args))
+            report(bot, args, stream, result, rss_before)
+        finally:
+            bot.history_store.close()
+            os.chdir(os.path.dirname(SRC_DIR))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+"""
+Check the alert sources against local stand-ins for the tzevaadom WebSocket and the oref endpoint.
+
+Covers the oref poller's conditional GETs (ETag and 304 Not Modified), skipping oref "event has
+ended" notices, the WebSocket's jittered reconnect backoff and its reset once frames arrive, and the
+first-arrival filter when both sources report the same cities. No network access is needed. Run
+from the repository root:
+
+    python checks/alert_sources.py
+
+Exits with status 1 and names the failed checks if there are any.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+import aiohttp
+from aiohttp import web
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from alert_sources import AlertSources, Backoff, OrefPoller, WebSocketSource  # noqa: E402
+from ingest import IngestQueue  # noqa: E402
+
+ROCKETS = "ירי רקטות וטילים"
+EVENT_ENDED = "האירוע הסתיים"
+DRILL = "ירי רקטות וטילים - תרגיל"
+
+
+def oref_alert(alert_id, title, cities, cat="1"):
+    return {"id": str(alert_id), "cat": cat, "title": title, "data": cities, "desc": ""}
+
+
+def tzevaadom_frame(notification_id, cities, threat=0, is_drill=False):
+    return {"type": "ALERT", "data": {
+        "notificationId": notification_id, "time": int(time.time()), "threat": threat,
+        "isDrill": is_drill, "cities": cities,
+    }}
+
+
+class LocalServer:
+    """aiohttp application on a free local port."""
+
+    def __init__(self):
+        self.runner = None
+        self.url = None
+
+    def routes(self, app):
+        raise NotImplementedError
+
+    async def start(self, scheme):
+        app = web.Application()
+        self.routes(app)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"{scheme}://127.0.0.1:{port}/"
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+class FakeOrefServer(LocalServer):
+    """Stand-in for oref alerts.json, answering with each alert in turn and an ETag per alert."""
+
+    def __init__(self, alerts):
+        super().__init__()
+        self.alerts = alerts  # None answers with the empty body oref sends when no alert is active
+        self.served = 0  # Alerts answered with 200 so far
+        self.not_modified = 0
+        self.conditional = 0  # Requests carrying If-None-Match
+        self.hold = asyncio.Event()  # Until set, every request gets the empty body
+        self.hold.set()
+
+    def routes(self, app):
+        app.router.add_get("/", self.handle)
+
+    async def handle(self, request):
+        if not self.hold.is_set():
+            return web.Response(body="\ufeff".encode("utf-8"), content_type="application/json")
+        index = min(self.served, len(self.alerts) - 1)
+        etag = f'"{index}"'
+        if request.headers.get("If-None-Match"):
+            self.conditional += 1
+        if request.headers.get("If-None-Match") == etag:
+            self.not_modified += 1
+            return web.Response(status=304, headers={"ETag": etag})
+        self.served = index + 1
+        alert = self.alerts[index]
+        body = "\ufeff" + (json.dumps(alert, ensure_ascii=False) if alert else "")
+        return web.Response(body=body.encode("utf-8"), content_type="application/json", headers={"ETag": etag})
+
+
+class FakeWebSocketServer(LocalServer):
+    """Stand-in for the tzevaadom WebSocket, sending each connection the queued frames and then closing it."""
+
+    def __init__(self):
+        super().__init__()
+        self.frames = []
+        self.connections = 0
+
+    def routes(self, app):
+        app.router.add_get("/", self.handle)
+
+    async def handle(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.connections += 1
+        frames, self.frames = self.frames, []
+        for frame in frames:
+            await ws.send_str(json.dumps(frame, ensure_ascii=False))
+        await ws.close()
+        return ws
+
+
+async def wait_until(condition, what, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError(f"timed out waiting for {what}")
+        await asyncio.sleep(0.01)
+
+
+async def run_until(coroutine, condition, what, timeout=5.0):
+    """Run a source's run() until the condition holds, then cancel it."""
+    task = asyncio.ensure_future(coroutine)
+    try:
+        await wait_until(lambda: task.done() or condition(), what, timeout)
+        if task.done():
+            task.result()  # Raises whatever stopped the source
+            raise AssertionError(f"the source stopped before {what}")
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+async def check_conditional_get(session):
+    """A repeated poll sends If-None-Match and treats 304 as no new alert."""
+    server = FakeOrefServer([oref_alert(1, ROCKETS, ["תל אביב - יפו"]), oref_alert(2, ROCKETS, ["חיפה"])])
+    await server.start("http")
+    try:
+        poller = OrefPoller(session, server.url)
+        first = await poller.poll()
+        assert first and first["id"] == "1", f"first poll returned {first}"
+        assert poller.etag == '"0"', f"poller kept ETag {poller.etag}"
+
+        server.served = 0  # Same alert again: the poller's ETag still matches
+        repeated = await poller.poll()
+        assert repeated is None, f"poll answered with 304 returned {repeated}"
+        assert server.not_modified == 1 and server.conditional == 1, "the repeated poll was not conditional"
+
+        server.served = 1
+        second = await poller.poll()
+        assert second and second["id"] == "2", f"poll after the alert changed returned {second}"
+    finally:
+        await server.stop()
+
+
+async def check_end_of_event(session):
+    """An "event has ended" notice and a repeated alert id are not emitted; a drill is flagged."""
+    server = FakeOrefServer([
+        oref_alert(1, ROCKETS, ["אשקלון"]),
+        oref_alert(1, ROCKETS, ["אשקלון"]),  # Still active: same id under a new ETag
+        oref_alert(2, EVENT_ENDED, ["אשקלון"], cat="13"),
+        None,
+        oref_alert(3, DRILL, ["אשדוד"]),
+        None,
+    ])
+    await server.start("http")
+    try:
+        emitted = []
+        poller = OrefPoller(session, server.url, min_interval=0.01, max_interval=0.02)
+        await run_until(poller.run(lambda source, alert_data, received_at: emitted.append(alert_data["data"])),
+                        lambda: server.served == len(server.alerts), "every oref answer")
+        ids = [(data["notificationId"], data["isDrill"]) for data in emitted]
+        assert ids == [("oref_1", False), ("oref_3", True)], f"emitted {ids}"
+    finally:
+        await server.stop()
+
+
+async def check_reconnect_backoff(session):
+    """Dropped connections back off with growing, jittered delays; a received frame starts over."""
+    server = FakeWebSocketServer()
+    await server.start("ws")
+    try:
+        source = WebSocketSource(session, server.url)
+        source.backoff = Backoff(base=0.01, maximum=0.08)
+        delays = []  # (attempt, delay)
+        next_delay = source.backoff.next_delay
+
+        def recorded_delay():
+            attempt = source.backoff.attempts
+            delay = next_delay()
+            delays.append((attempt, delay))
+            return delay
+
+        source.backoff.next_delay = recorded_delay
+        emitted = []
+        emit = lambda source_name, alert_data, received_at: emitted.append(alert_data)  # noqa: E731
+        await run_until(source.run(emit), lambda: len(delays) >= 12, "12 reconnects")
+
+        attempts = [attempt for attempt, _ in delays]
+        assert attempts == list(range(len(delays))), f"backoff attempts {attempts} did not keep growing"
+        for attempt, delay in delays:
+            limit = min(0.08, 0.01 * 2 ** attempt)
+            assert 0 <= delay <= limit, f"delay {delay:.3f} s at attempt {attempt} is outside 0-{limit} s"
+        assert len({round(delay, 6) for _, delay in delays}) > 1, "reconnect delays are not jittered"
+        assert any(delay > 0.01 for _, delay in delays), "reconnect delays never grew past the base"
+
+        server.frames.append(tzevaadom_frame("reconnect-1", ["שדרות"]))
+        count = len(delays)
+        await run_until(source.run(emit), lambda: len(delays) > count, "a reconnect after the frame")
+        assert [alert["data"]["notificationId"] for alert in emitted] == ["reconnect-1"], f"emitted {emitted}"
+        assert delays[count][0] == 0, f"backoff was at attempt {delays[count][0]} after a frame, not reset"
+    finally:
+        await server.stop()
+
+
+async def check_first_arrival(session):
+    """Cities already reported by the other source are dropped, unless the drill flag differs."""
+    ws_server = FakeWebSocketServer()
+    oref_server = FakeOrefServer([
+        oref_alert(1, ROCKETS, ["נתיבות", "אופקים"]),  # נתיבות came from the WebSocket first
+        oref_alert(2, ROCKETS, ["שדרות"]),  # Nothing new
+        oref_alert(3, DRILL, ["שדרות"]),  # A drill is not the real alert
+        None,
+    ])
+    oref_server.hold.clear()
+    ws_server.frames.append(tzevaadom_frame("ws-1", ["שדרות", "נתיבות"]))
+    await ws_server.start("ws")
+    await oref_server.start("http")
+    try:
+        queue = IngestQueue()
+        sources = AlertSources([
+            WebSocketSource(session, ws_server.url),
+            OrefPoller(session, oref_server.url, min_interval=0.01, max_interval=0.02),
+        ], queue)
+
+        async def release_oref():
+            await wait_until(lambda: len(queue) == 1, "the WebSocket alert")
+            oref_server.hold.set()
+
+        release = asyncio.ensure_future(release_oref())
+        await run_until(sources.run(), lambda: oref_server.served == len(oref_server.alerts), "every oref answer")
+        await release
+
+        queued = []
+        while len(queue):
+            _, alert_data = await queue.get()
+            queued.append((alert_data["data"]["notificationId"], alert_data["data"]["cities"]))
+        expected = [("ws-1", ["שדרות", "נתיבות"]), ("oref_1", ["אופקים"]), ("oref_3", ["שדרות"])]
+        assert queued == expected, f"queued {queued}"
+        assert sources.first == {"websocket": 1, "oref": 2}, f"first arrivals {sources.first}"
+        assert sources.duplicates == {"websocket": 0, "oref": 1}, f"duplicates {sources.duplicates}"
+    finally:
+        await oref_server.stop()
+        await ws_server.stop()
+
+
+CHECKS = (check_conditional_get, check_end_of_event, check_reconnect_backoff, check_first_arrival)
+
+
+async def run_checks():
+    failures = []
+    async with aiohttp.ClientSession() as session:
+        for check in CHECKS:
+            try:
+                await check(session)
+            except AssertionError as e:
+                failures.append(check.__name__)
+                print(f"FAIL {check.__name__}: {e}")
+            else:
+                print(f"ok   {check.__name__}: {check.__doc__}")
+    return failures
+
+
+def main():
+    logging.basicConfig(level=logging.CRITICAL)  # The sources log every reconnect and skipped notice
+    random.seed(0)
+    failures = asyncio.run(run_checks())
+    if failures:
+        print(f"{len(failures)} of {len(CHECKS)} checks failed: {', '.join(failures)}")
+        sys.exit(1)
+    print(f"All {len(CHECKS)} checks passed.")
+
+
+if __name__ == "__main__":
+    main()
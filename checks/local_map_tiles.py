@@ -0,0 +1,83 @@
+"""
+Check that a prewarmed tile cache gives the local map renderer a basemap for every one-area alert.
+
+The renderer never downloads tiles, so a map whose zoom level or tiles prewarm() does not cover is
+drawn on a plain background. This frames every area the way an alert for that area alone is
+framed, and checks that each tile of its basemap is one prewarm() would have downloaded. No
+network access is needed. Run from the repository root:
+
+    python checks/local_map_tiles.py
+
+Exits with status 1 and lists the areas without a full basemap if there are any.
+"""
+import io
+import os
+import sys
+from collections import Counter
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from geodata import GeoData  # noqa: E402
+from map_renderer import LocalMapRenderer  # noqa: E402
+from tile_cache import HEATMAP_ZOOMS, ISRAEL_BOUNDS, tiles_for_extent  # noqa: E402
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+
+class PrewarmedTiles:
+    """Stand-in for a TileCache holding exactly the tiles prewarm() downloads."""
+
+    def __init__(self, tile):
+        self.tile = tile
+        self.available = {key for zoom in HEATMAP_ZOOMS for key in tiles_for_extent(ISRAEL_BOUNDS, zoom)}
+        self.missing = set()
+
+    def read(self, z, x, y):
+        if (z, x, y) in self.available:
+            return self.tile
+        self.missing.add((z, x, y))
+        return None
+
+
+def main():
+    buffer = io.BytesIO()
+    Image.new("RGB", (256, 256), (255, 255, 255)).save(buffer, format="PNG")
+    tiles = PrewarmedTiles(buffer.getvalue())
+    renderer = LocalMapRenderer(tiles)
+
+    geodata = GeoData({
+        "targets": os.path.join(DATA_DIR, "targets.json"),
+        "area_to_polygon": os.path.join(DATA_DIR, "area_to_polygon.json"),
+        "area_to_coordinates": os.path.join(DATA_DIR, "area_to_coordinates.json"),
+        "locality_residents": os.path.join(DATA_DIR, "locality_residents.json"),
+        "population_table": os.path.join(DATA_DIR, "population_table.json"),
+        "packed_geometry": os.path.join(DATA_DIR, "area_geometry.bin"),
+    })
+
+    zooms = Counter()
+    failures = []
+    for area in geodata.area_to_polygon:
+        polygons = [np.asarray(geodata.area_to_polygon[area], dtype=float)]
+        markers = np.array([[coord["lat"], coord["lng"]] for coord in geodata.get_coordinates(area).values()]).reshape(-1, 2)
+        zoom, left, top = renderer.frame(polygons, markers)
+        zooms[zoom] += 1
+        tiles.missing.clear()
+        renderer.basemap(zoom, left, top)
+        if tiles.missing:
+            failures.append((area, zoom, len(tiles.missing)))
+
+    print("Zoom levels of one-area alert maps: " + ", ".join(f"{zoom}: {count}" for zoom, count in sorted(zooms.items())))
+    print(f"Prewarmed zoom levels: {HEATMAP_ZOOMS[0]}-{HEATMAP_ZOOMS[-1]}")
+    if failures:
+        print(f"{len(failures)} of {sum(zooms.values())} areas are missing basemap tiles:")
+        for area, zoom, missing in failures[:20]:
+            print(f"  {area}: {missing} tiles at zoom {zoom}")
+        sys.exit(1)
+    print(f"All {sum(zooms.values())} areas have a full basemap.")
+
+
+if __name__ == "__main__":
+    main()
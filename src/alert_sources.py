@@ -0,0 +1,273 @@
+"""
+Alert sources.
+
+The bot can listen to more than one feed at the same time: the tzevaadom WebSocket, and the Home
+Front Command (oref) alerts.json endpoint polled with conditional GETs. Each source turns what it
+receives into the WebSocket's alert format:
+
+    {"data": {"notificationId": ..., "time": ..., "threat": ..., "isDrill": ..., "cities": [...]}}
+
+AlertSources passes them through a first-arrival filter into the ingest queue. When two sources
+report the same city for the same threat, only the first report is kept. Sources reconnect or
+retry with exponential backoff and jitter. URLs are parameters, so tests can point the sources
+at local servers.
+"""
+import asyncio
+import logging
+import random
+import time
+from collections import OrderedDict
+
+import aiohttp
+
+from ingest import json_loads
+from metrics import latency
+
+# Threat codes of the WebSocket format for oref categories and titles
+OREF_CATEGORIES = {"1": 0, "6": 5}
+OREF_TITLE_THREATS = (
+    ("רקטות", 0),  # Rockets and missiles
+    ("כלי טיס", 5),  # Hostile aircraft intrusion
+    ("מחבלים", 2),  # Terrorist infiltration
+    ("רעידת אדמה", 3),  # Earthquake
+    ("צונאמי", 4),  # Tsunami
+    ("חומרים מסוכנים", 1),  # Hazardous materials
+    ("רדיולוגי", 6),  # Radiological incident
+)
+OREF_DRILL_WORD = "תרגיל"
+
+
+def normalize_tzevaadom(frame):
+    """Return a WebSocket frame as an alert, or None if it is another kind of message."""
+    if not isinstance(frame, dict) or frame.get("type", "ALERT") != "ALERT" or not isinstance(frame.get("data"), dict):
+        return None
+    return {"data": frame["data"]}
+
+
+def normalize_oref(alert, received_at):
+    """Convert an oref alerts.json object to the WebSocket alert format, or None if it is not an alert."""
+    if not isinstance(alert, dict) or not alert.get("id") or not alert.get("data"):
+        return None
+    title = alert.get("title", "")
+    threat = OREF_CATEGORIES.get(str(alert.get("cat")))
+    if threat is None:
+        threat = next((code for word, code in OREF_TITLE_THREATS if word in title), None)
+    if threat is None:
+        # Unknown categories include "the event has ended" notices, which are not alerts
+        logging.info(f"Ignoring oref message of category {alert.get('cat')}: {title}")
+        return None
+    return {
+        "data": {
+            "notificationId": f"oref_{alert['id']}",
+            "time": int(received_at),
+            "threat": threat,
+            "isDrill": OREF_DRILL_WORD in title,
+            "cities": list(alert["data"]),
+        }
+    }
+
+
+class Backoff:
+    """Exponential backoff with full jitter."""
+
+    def __init__(self, base=1.0, maximum=60.0):
+        self.base = base
+        self.maximum = maximum
+        self.attempts = 0
+
+    def next_delay(self):
+        delay = random.uniform(0, min(self.maximum, self.base * 2 ** self.attempts))
+        self.attempts += 1
+        return delay
+
+    def reset(self):
+        self.attempts = 0
+
+
+class FirstArrivalFilter:
+    """Drops cities that another source already reported for the same threat and drill flag within the TTL."""
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self._seen = OrderedDict()  # (threat, is drill, city) -> (source name, time first reported), oldest first
+
+    def filter(self, source, alert_data, now=None):
+        """Return the alert with cities first reported by other sources removed, or None if none are left."""
+        now = time.time() if now is None else now
+        while self._seen and now - next(iter(self._seen.values()))[1] >= self.ttl:
+            self._seen.popitem(last=False)
+
+        data = alert_data.get("data", {})
+        threat = data.get("threat", 0)
+        is_drill = bool(data.get("isDrill", False))
+        cities = []
+        for city in data.get("cities", []):
+            key = (threat, is_drill, city)
+            first = self._seen.get(key)
+            if first is None:
+                self._seen[key] = (source, now)
+                cities.append(city)
+            elif first[0] == source:
+                cities.append(city)  # A source repeating a city is a new alert, not a duplicate
+        if not cities:
+            return None
+        return {**alert_data, "data": {**data, "cities": cities}}
+
+
+class WebSocketSource:
+    """The tzevaadom WebSocket."""
+
+    name = "websocket"
+    stable_after = 60  # Seconds a connection must stay up before the backoff starts over
+
+    def __init__(self, session: aiohttp.ClientSession, url, headers=None, receive_timeout=120):
+        self.session = session
+        self.url = url
+        self.headers = headers or {}
+        self.receive_timeout = receive_timeout  # Seconds without a message before pinging
+        self.backoff = Backoff()
+
+    async def run(self, emit):
+        """Receive alerts forever, reconnecting after errors."""
+        while True:
+            connected_at = None
+            try:
+                async with self.session.ws_connect(self.url, headers=self.headers) as ws:
+                    logging.info("Connected to WebSocket.")
+                    connected_at = time.monotonic()
+                    await self._receive(ws, emit)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"WebSocket connection error: {e}")
+            # A server that accepts connections and drops them at once still gets backed off from
+            if connected_at is not None and time.monotonic() - connected_at >= self.stable_after:
+                self.backoff.reset()
+            delay = self.backoff.next_delay()
+            logging.info(f"Reconnecting to the WebSocket in {delay:.1f} seconds...")
+            await asyncio.sleep(delay)
+
+    async def _receive(self, ws, emit):
+        while True:
+            try:
+                msg = await ws.receive(timeout=self.receive_timeout)  # Timeout to detect dead connections
+            except asyncio.TimeoutError:
+                # If no message is received for a while, send a ping to check the connection
+                await ws.ping()
+                logging.info("Sent a ping to the WebSocket server.")
+                continue
+
+            if msg.type == aiohttp.WSMsgType.TEXT:
+                self.backoff.reset()  # The connection works
+                received_at = time.time()
+                try:
+                    with latency.timer("parse"):
+                        alert_data = normalize_tzevaadom(json_loads(msg.data))
+                except ValueError as e:
+                    logging.error(f"Failed to decode JSON message: {e}")
+                    continue
+                if alert_data:
+                    sent_at = alert_data["data"].get("time")
+                    if isinstance(sent_at, (int, float)) and 0 <= received_at - sent_at < 3600:
+                        latency.observe("receive", received_at - sent_at)  # Whole seconds, as the feed reports them
+                    emit(self.name, alert_data, received_at)
+            elif msg.type in (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                logging.error(f"WebSocket closed or error: {msg.type}")
+                return  # Reconnect
+
+
+class OrefPoller:
+    """Polls the oref alerts.json endpoint with conditional GETs."""
+
+    name = "oref"
+
+    def __init__(self, session: aiohttp.ClientSession, url, min_interval=1.0, max_interval=3.0):
+        self.session = session
+        self.url = url
+        self.min_interval = min_interval  # Poll interval while alerts are coming in
+        self.max_interval = max_interval  # Poll interval after a quiet period
+        self.interval = min_interval
+        self.backoff = Backoff(base=min_interval)
+        self.etag = None
+        self.last_modified = None
+        self.last_id = None  # alerts.json keeps returning the active alert; each id is emitted once
+        self.headers = {
+            "Referer": "https://www.oref.org.il/",
+            "X-Requested-With": "XMLHttpRequest",
+            "Accept": "application/json",
+        }
+
+    async def poll(self):
+        """Fetch the endpoint once and return the new alert, if there is one."""
+        headers = dict(self.headers)
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        async with self.session.get(self.url, headers=headers) as response:
+            if response.status == 304:
+                return None
+            if response.status != 200:
+                raise aiohttp.ClientResponseError(
+                    response.request_info, response.history, status=response.status, message="oref poll failed"
+                )
+            self.etag = response.headers.get("ETag", self.etag)
+            self.last_modified = response.headers.get("Last-Modified", self.last_modified)
+            body = (await response.read()).decode("utf-8-sig").strip()  # The endpoint adds a byte order mark
+
+        if not body:
+            return None  # No active alert
+        with latency.timer("parse"):
+            alert = json_loads(body)
+        if not isinstance(alert, dict) or alert.get("id") == self.last_id:
+            return None
+        self.last_id = alert.get("id")
+        return alert
+
+    async def run(self, emit):
+        """Poll forever, faster while alerts are active and with backoff after errors."""
+        while True:
+            try:
+                alert = await self.poll()
+                self.backoff.reset()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                delay = self.backoff.next_delay()
+                logging.error(f"Polling {self.url} failed: {e}. Retrying in {delay:.1f} seconds...")
+                await asyncio.sleep(delay)
+                continue
+
+            if alert is not None:
+                received_at = time.time()
+                alert_data = normalize_oref(alert, received_at)
+                if alert_data:
+                    emit(self.name, alert_data, received_at)
+                self.interval = self.min_interval
+            else:
+                self.interval = min(self.max_interval, self.interval * 1.5)
+            await asyncio.sleep(self.interval)
+
+
+class AlertSources:
+    """Runs every alert source and queues the first report of each alert."""
+
+    def __init__(self, sources, queue, dedupe_ttl=60):
+        self.sources = sources
+        self.queue = queue  # IngestQueue
+        self.filter = FirstArrivalFilter(dedupe_ttl)
+        self.first = {source.name: 0 for source in sources}  # Alerts each source delivered first
+        self.duplicates = {source.name: 0 for source in sources}  # Alerts another source had already delivered
+
+    def emit(self, source, alert_data, received_at):
+        alert_data = self.filter.filter(source, alert_data, received_at)
+        if alert_data is None:
+            self.duplicates[source] += 1
+            logging.info(f"Alert from {source} was already received from another source")
+            return
+        self.first[source] += 1
+        self.queue.put(alert_data, received_at)
+
+    async def run(self):
+        """Run all sources until cancelled."""
+        await asyncio.gather(*(source.run(self.emit) for source in self.sources))
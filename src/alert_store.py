@@ -0,0 +1,233 @@
+"""
+Durable storage for the alert history.
+
+Alerts are kept in a SQLite database with an index on the alert time. Writes are queued and
+committed in batches by a background thread, so a large salvo costs one transaction instead of a
+file rewrite per city, and the event loop never waits on the disk. SQLite's write-ahead log makes
+the store crash safe: a batch is either fully committed or not visible after a restart.
+"""
+import bisect
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS alerts (
+    id INTEGER PRIMARY KEY,
+    ts INTEGER NOT NULL,
+    city_en TEXT NOT NULL,
+    city_he TEXT NOT NULL,
+    migun_time INTEGER,
+    lat REAL,
+    lng REAL
+);
+CREATE INDEX IF NOT EXISTS alerts_ts ON alerts (ts);
+"""
+INSERT_SQL = "INSERT INTO alerts (ts, city_en, city_he, migun_time, lat, lng) VALUES (?, ?, ?, ?, ?, ?)"
+
+COMPACTION_INTERVAL = 24 * 60 * 60  # Seconds between retention passes on the writer thread
+MAX_CACHED_QUERIES = 64  # Period queries kept by AlertHistory.query
+
+
+def entry_to_row(entry):
+    """Flatten an alert history entry into an alerts table row."""
+    city_en, city_he, migun_time, coordinates, timestamp = entry
+    coord = coordinates.get(city_he) or {}
+    return timestamp, city_en, city_he, migun_time, coord.get('lat'), coord.get('lng')
+
+
+def row_to_entry(row):
+    """Rebuild an alert history entry from an alerts table row."""
+    timestamp, city_en, city_he, migun_time, lat, lng = row
+    coordinates = {city_he: {'lat': lat, 'lng': lng}} if lat is not None else {}
+    return city_en, city_he, migun_time, coordinates, timestamp
+
+
+class AlertHistoryStore:
+    """Append-only alert history in SQLite, written in batches by a background thread."""
+
+    def __init__(self, path, retention_days=None, legacy_json_path=None):
+        self.path = path
+        self.retention_days = retention_days
+        self._queue = queue.Queue()
+        is_new = not os.path.exists(path)
+
+        conn = self._connect()
+        with conn:
+            conn.executescript(SCHEMA)
+        if is_new and legacy_json_path:
+            self._import_legacy_json(conn, legacy_json_path)
+        conn.close()
+
+        self.compact()
+        self._writer = threading.Thread(target=self._write_loop, name="alert-history-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=FULL")
+        return conn
+
+    def _import_legacy_json(self, conn, json_path):
+        """Import entries from the old alert_history.json the first time the database is created."""
+        try:
+            with open(json_path, 'r') as file:
+                entries = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        with conn:
+            conn.executemany(INSERT_SQL, [entry_to_row(entry) for entry in entries])
+        logging.info(f"Imported {len(entries)} alerts from {json_path} into {self.path}")
+
+    def load(self, since=None):
+        """Return stored alerts newer than `since` (a Unix timestamp), oldest first."""
+        if since is None and self.retention_days:
+            since = time.time() - self.retention_days * 86400
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT ts, city_en, city_he, migun_time, lat, lng FROM alerts WHERE ts >= ? ORDER BY ts, id",
+                (since or 0,)
+            ).fetchall()
+        finally:
+            conn.close()
+        return [row_to_entry(row) for row in rows]
+
+    def append(self, entries):
+        """Queue alert history entries for writing. Never blocks on the disk."""
+        if entries:
+            self._queue.put([entry_to_row(entry) for entry in entries])
+
+    def flush(self):
+        """Block until every queued entry has been committed."""
+        self._queue.join()
+
+    def close(self):
+        """Commit pending entries and stop the writer thread."""
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+
+    def compact(self, conn=None):
+        """Drop alerts older than the retention period and shrink the write-ahead log."""
+        own_conn = conn is None
+        conn = conn or self._connect()
+        try:
+            if self.retention_days:
+                cutoff = time.time() - self.retention_days * 86400
+                with conn:
+                    deleted = conn.execute("DELETE FROM alerts WHERE ts < ?", (cutoff,)).rowcount
+                if deleted:
+                    logging.info(f"Removed {deleted} alerts older than {self.retention_days} days from history")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except sqlite3.Error as e:
+            logging.error(f"Failed to compact alert history: {e}")
+        finally:
+            if own_conn:
+                conn.close()
+
+    def _write_loop(self):
+        """Commit queued entries, grouping everything that is waiting into one transaction."""
+        conn = self._connect()
+        next_compaction = time.time() + COMPACTION_INTERVAL
+        stop = False
+        while not stop:
+            batches = [self._queue.get()]
+            while True:
+                try:
+                    batches.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            rows = []
+            for batch in batches:
+                if batch is None:
+                    stop = True
+                else:
+                    rows.extend(batch)
+            try:
+                if rows:
+                    with conn:
+                        conn.executemany(INSERT_SQL, rows)
+            except sqlite3.Error as e:
+                logging.error(f"Failed to save {len(rows)} alerts to history: {e}")
+            finally:
+                for _ in batches:
+                    self._queue.task_done()
+
+            if time.time() >= next_compaction:
+                self.compact(conn)
+                next_compaction = time.time() + COMPACTION_INTERVAL
+        conn.close()
+
+
+class AlertHistory:
+    """
+    In-memory alert history kept sorted by alert time.
+
+    Period queries find their first alert with a binary search and only touch the matching
+    slice. Results are cached per query key and reused while no new alerts have arrived and the
+    start of the period still falls on the same alert.
+    """
+
+    def __init__(self, entries=()):
+        self.entries = sorted(entries, key=lambda entry: entry[4])
+        self.timestamps = [entry[4] for entry in self.entries]
+        self.version = 0  # Incremented whenever alerts are added
+        self._cache = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def extend(self, entries):
+        """Add alerts, keeping the history ordered by time."""
+        for entry in entries:
+            timestamp = entry[4]
+            if not self.timestamps or timestamp >= self.timestamps[-1]:
+                self.entries.append(entry)
+                self.timestamps.append(timestamp)
+            else:
+                index = bisect.bisect_right(self.timestamps, timestamp)
+                self.entries.insert(index, entry)
+                self.timestamps.insert(index, timestamp)
+        if entries:
+            self.version += 1
+
+    def since(self, start_time):
+        """Return the alerts at or after start_time, oldest first."""
+        return self.entries[bisect.bisect_left(self.timestamps, start_time):]
+
+    def between(self, start_time, end_time):
+        """Return the alerts with start_time <= time < end_time, oldest first."""
+        return self.entries[bisect.bisect_left(self.timestamps, start_time):bisect.bisect_left(self.timestamps, end_time)]
+
+    def generation(self, start_time):
+        """
+        Identify the contents of the window from start_time until now.
+
+        The version changes whenever alerts are added and the start index changes when old alerts
+        age out of the window, so equal generations always cover the same alerts.
+        """
+        return self.version, bisect.bisect_left(self.timestamps, start_time)
+
+    def query(self, key, start_time, compute):
+        """Return compute(alerts since start_time), reusing the cached result when nothing changed."""
+        start = bisect.bisect_left(self.timestamps, start_time)
+        cached = self._cache.get(key)
+        if cached and cached[0] == self.version and cached[1] == start:
+            return cached[2]
+
+        result = compute(self.entries[start:])
+        self._cache.pop(key, None)
+        if len(self._cache) >= MAX_CACHED_QUERIES:
+            self._cache.pop(next(iter(self._cache)))  # Drop the least recently computed query
+        self._cache[key] = (self.version, start, result)
+        return result
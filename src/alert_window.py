@@ -0,0 +1,103 @@
+"""
+Sliding window of recently alerted cities.
+
+An alert message lists every city alerted in the last minute, and each new alert in a burst
+updates that message. The window keeps the cities in a dict keyed by their Hebrew name, in
+arrival order, with a deque of arrival times for expiry. The population total, the number of
+cities per alert area and the message lines are updated as cities enter and leave, so an update
+never rescans the whole window.
+"""
+import time
+from collections import deque
+
+
+class AlertWindow:
+    """Cities alerted within the last `duration` seconds, with running totals."""
+
+    def __init__(self, duration=60):
+        self.duration = duration
+        self._entries = {}  # city_he -> (city_en, city_he, migun_time, coordinates, timestamp), oldest first
+        self._expiry = deque()  # (timestamp, city_he) in arrival order
+        self._lines = {}  # city_he -> description line, in the same order as _entries
+        self._by_name = {}  # lowercase English name -> {city_he: population}, cities sharing a name count once
+        self._area_of = {}  # city_he -> alert area id
+        self.area_counts = {}  # alert area id -> cities of that area in the window
+        self.population = 0
+        self.category = None  # Alert category of the cities in the window
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(self._entries.values())
+
+    def __contains__(self, city_he):
+        return city_he in self._entries
+
+    def __repr__(self):
+        return f"AlertWindow({len(self._entries)} cities)"
+
+    @staticmethod
+    def _name_population(populations):
+        """Population counted for a group of cities sharing an English name: the first one known."""
+        return next((population for population in populations.values() if population), 0)
+
+    @staticmethod
+    def line(entry):
+        """Description line for an alert history entry: its English name and time to take shelter."""
+        return f"{entry[0]} ({entry[2]}s)"
+
+    def add(self, entry, population=0, area=None):
+        """Add an alert history entry for a city that is not in the window."""
+        city_en, city_he, _, _, timestamp = entry
+        self._entries[city_he] = entry
+        self._expiry.append((timestamp, city_he))
+        self._lines[city_he] = self.line(entry)
+        self._area_of[city_he] = area
+        self.area_counts[area] = self.area_counts.get(area, 0) + 1
+
+        populations = self._by_name.setdefault(city_en.lower(), {})
+        self.population -= self._name_population(populations)
+        populations[city_he] = population
+        self.population += self._name_population(populations)
+
+    def _remove(self, city_he):
+        city_en = self._entries.pop(city_he)[0]
+        del self._lines[city_he]
+        area = self._area_of.pop(city_he)
+        self.area_counts[area] -= 1
+        if not self.area_counts[area]:
+            del self.area_counts[area]
+        populations = self._by_name[city_en.lower()]
+        self.population -= self._name_population(populations)
+        del populations[city_he]
+        if populations:
+            self.population += self._name_population(populations)
+        else:
+            del self._by_name[city_en.lower()]
+
+    def expire(self, now=None):
+        """Drop the cities alerted `duration` seconds ago or earlier."""
+        now = time.time() if now is None else now
+        while self._expiry and now - self._expiry[0][0] >= self.duration:
+            _, city_he = self._expiry.popleft()
+            self._remove(city_he)
+
+    def clear(self, category=None):
+        """Empty the window, e.g. to start collecting alerts of a new category."""
+        self._entries.clear()
+        self._expiry.clear()
+        self._lines.clear()
+        self._by_name.clear()
+        self._area_of.clear()
+        self.area_counts.clear()
+        self.population = 0
+        self.category = category
+
+    def lines(self):
+        """Description lines for the cities in the window, oldest first."""
+        return list(self._lines.values())
+
+    def areas(self):
+        """Hebrew names of the cities in the window, which are also their map area names."""
+        return self._entries.keys()
@@ -0,0 +1,229 @@
+"""
+Chart rendering for the statistics commands.
+
+Charts are drawn with matplotlib in a pool of worker processes so that a slow render never
+blocks the event loop that receives and delivers alerts. The render functions are plain
+functions that take simple data and return PNG bytes, which makes them safe to run in a
+separate process.
+"""
+import asyncio
+import io
+import logging
+import multiprocessing
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import matplotlib
+
+matplotlib.use("Agg")  # Workers have no display
+import numpy as np
+from matplotlib import pyplot as plt
+
+from heatmap_grid import CELL_SIZE, GRID_COLUMNS, GRID_ROWS, MIN_LAT, MIN_LNG, gaussian_blur
+from tile_cache import TileCache
+
+
+def render_bar_chart(cities, alert_counts, period):
+    """Render a bar chart of alert counts per city and return it as PNG bytes."""
+    plt.figure(figsize=(10, 6), facecolor='#181818')
+    bars = plt.barh(cities, alert_counts, color='#CB0000')  # Dark red bars
+
+    # Add the number of alerts on the bars
+    for bar, count in zip(bars, alert_counts):
+        plt.text(bar.get_width() + 0.1, bar.get_y() + bar.get_height() / 2,
+                 f'{count}', va='center', ha='left', color='red')  # Bright red text
+
+    plt.xlabel('Number of Alerts', color='white')  # White axis label
+    plt.ylabel('Cities', color='white')  # White axis label
+    plt.title(f'Alert Stats for the Past {period}', color='white')  # White title
+    plt.gca().tick_params(axis='both', colors='white')  # White tick labels
+    plt.gca().spines['bottom'].set_color('white')  # White axis line
+    plt.gca().spines['left'].set_color('white')  # White axis line
+    plt.gca().spines['top'].set_color('white')  # White axis line
+    plt.gca().spines['right'].set_color('white')  # White axis line
+    plt.gca().set_facecolor('#181818')  # Set background color to black
+    plt.tight_layout()
+    buf = io.BytesIO()
+    plt.savefig(buf, format='png', facecolor='#181818')  # Save with black background
+    plt.close()
+    return buf.getvalue()
+
+
+def render_heatmap(counts, period, tiles_dir, extent, zoom):
+    """
+    Render a heatmap from a grid of alert counts and return it as PNG bytes.
+
+    The basemap is stitched from tiles already in the on-disk tile cache at tiles_dir.
+    """
+    density = gaussian_blur(counts)
+    density = np.ma.masked_less(density, density.max() * 0.02)  # Leave near-empty cells transparent
+
+    # Increase the figure size and DPI for higher resolution
+    plt.figure(figsize=(12, 10), dpi=300)
+
+    # Plot the heatmap with semi-transparency; grid row 0 is the southern edge
+    plt.imshow(
+        density,
+        cmap="Reds",
+        alpha=0.5,  # Adjust this value for desired transparency
+        origin="lower",
+        extent=(MIN_LNG, MIN_LNG + GRID_COLUMNS * CELL_SIZE, MIN_LAT, MIN_LAT + GRID_ROWS * CELL_SIZE),
+        interpolation="bilinear",
+        zorder=1,
+    )
+
+    minx, maxx, miny, maxy = extent
+    # Optionally, add a map background
+    try:
+        basemap = TileCache(tiles_dir).stitch(extent, zoom)
+        plt.imshow(basemap, extent=(minx, maxx, miny, maxy), zorder=0)
+    except Exception as e:
+        logging.warning(f"Failed to add basemap: {e}")
+    plt.xlim(minx, maxx)
+    plt.ylim(miny, maxy)
+
+    plt.title(f'Alert Heatmap for the Past {period}', fontsize=16)
+    plt.xlabel('Longitude', fontsize=12, color='white')
+    plt.ylabel('Latitude', fontsize=12, color='white')
+
+    plt.tight_layout()
+
+    # Save the heatmap to a BytesIO object with higher quality
+    buf = io.BytesIO()
+    plt.savefig(buf, format='png', bbox_inches='tight', dpi=300)
+    plt.close()
+    return buf.getvalue()
+
+
+class ChartCache:
+    """LRU cache of rendered chart PNGs, bounded by their total size in bytes."""
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._images = OrderedDict()  # (command, period, history generation) -> PNG bytes
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the cached PNG for a key, or None."""
+        image = self._images.get(key)
+        if image is None:
+            self.misses += 1
+            return None
+        self._images.move_to_end(key)
+        self.hits += 1
+        return image
+
+    def put(self, key, image):
+        """Cache a rendered PNG, evicting the least recently used ones past the size bound."""
+        if len(image) > self.max_bytes:
+            return
+        old = self._images.pop(key, None)
+        if old is not None:
+            self._size -= len(old)
+        self._images[key] = image
+        self._size += len(image)
+        while self._size > self.max_bytes:
+            _, evicted = self._images.popitem(last=False)
+            self._size -= len(evicted)
+
+
+class RenderRejected(Exception):
+    """Raised when a render request is refused; the message is meant for the user."""
+
+
+class RenderPool:
+    """
+    Process pool for chart rendering with a bounded queue, per-user rate limiting and a timeout.
+    """
+
+    def __init__(self, workers=2, max_pending=4, user_cooldown=10, timeout=60):
+        self.workers = workers
+        self.max_pending = max_pending  # Jobs queued or running before new requests are refused
+        self.user_cooldown = user_cooldown  # Seconds a user waits between renders
+        self.timeout = timeout
+        self._executor = None
+        self._pending = 0
+        self._last_request = {}  # user id -> time of the last accepted request
+
+    @staticmethod
+    def _start_method():
+        # Forked workers start with matplotlib already imported. Spawned workers would re-run
+        # main.py as their main module, so fork is used wherever the platform has it.
+        return "fork" if "fork" in multiprocessing.get_all_start_methods() else None
+
+    def _get_executor(self):
+        """Create the executor on first use."""
+        if self._executor is None:
+            context = multiprocessing.get_context(self._start_method())
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=context)
+        return self._executor
+
+    def start(self):
+        """
+        Fork the worker processes now, while the process has a single thread.
+
+        A child forked while another thread holds a lock (logging, SQLite, a resolver) can deadlock
+        on it. A fork pool starts all its workers on the first job and never forks again, so one
+        empty job at startup is enough. Without fork, workers are spawned on first use instead.
+        """
+        if self._start_method() == "fork":
+            self._get_executor().submit(int).result()
+
+    async def render(self, user_id, function, *args):
+        """Run a render function in the pool and return its PNG bytes."""
+        now = time.monotonic()
+        last = self._last_request.get(user_id)
+        if last is not None and now - last < self.user_cooldown:
+            raise RenderRejected(f"Please wait {self.user_cooldown - (now - last):.0f} more seconds before "
+                                 f"requesting another chart.")
+        if self._pending >= self.max_pending:
+            raise RenderRejected("Too many charts are being rendered right now. Please try again shortly.")
+
+        self._last_request[user_id] = now
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        try:
+            future = loop.run_in_executor(executor, function, *args)
+        except BrokenProcessPool:
+            # A worker died after the last render finished; start a new pool for this one
+            self._discard(executor)
+            executor = self._get_executor()
+            future = loop.run_in_executor(executor, function, *args)
+        self._pending += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            logging.error(f"Rendering {function.__name__} timed out after {self.timeout} seconds")
+            raise RenderRejected("Rendering the chart took too long. Try a shorter period.")
+        except BrokenProcessPool as e:
+            logging.error(f"A worker died while rendering {function.__name__}: {e}. Starting a new pool.")
+            self._discard(executor)
+            raise RenderRejected("Rendering the chart failed. Please try again.")
+        finally:
+            if future.done():
+                self._pending -= 1
+            else:
+                # The worker keeps running after a timeout, so its slot is freed only when it finishes
+                future.add_done_callback(lambda _: self._release())
+
+    def _discard(self, executor):
+        """Drop a pool broken by a dead worker, so the next render starts a new one."""
+        # The new workers are forked while other threads run, which start() avoids; this only
+        # happens after a worker crashed, and a pool that stays broken would disable charts
+        if self._executor is executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _release(self):
+        """Free the queue slot of a job that finished after its timeout."""
+        self._pending -= 1
+
+    def shutdown(self):
+        """Stop the worker processes."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,378 @@
+"""
+Geographic data shared by the alert pipeline and every command.
+
+The data files are parsed once into a GeoData snapshot that is never modified afterwards. Callers
+hold a reference to the snapshot; reloading builds a new one and swaps the reference, so readers
+never see a half-loaded state.
+
+Area polygons and coordinates can also be packed into a compact binary file that is memory-mapped
+at startup instead of parsing the JSON into millions of Python floats. The JSON files remain the
+source of truth; regenerate the packed file after editing them with:
+
+    python geodata.py
+"""
+import hashlib
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from urllib.parse import quote
+
+import numpy as np
+from shapely.geometry import Polygon
+from shapely.ops import unary_union
+
+from population import load_population_table
+
+PACKED_MAGIC = b"RAGEO\x00\x00\x01"
+PACKED_HEADER = struct.Struct("<8sQ")  # Magic, length of the JSON header that follows
+SIMPLIFY_TOLERANCES = (0.001, 0.003, 0.01, 0.03)  # Douglas-Peucker tolerances, in degrees, from finest to coarsest
+MERGE_DISTANCES = (0, 0.01, 0.03)  # Gaps, in degrees, bridged when merging neighbouring areas into one outline
+MERGED_CACHE_SIZE = 48  # Merged outlines kept; each alert update of a large salvo needs up to one per merge distance
+
+
+def html_to_discord(html):
+    """Convert HTML to Discord markdown."""
+    html = html.replace("<br>", "\n")
+    html = html.replace("<b>", "**").replace("</b>", "**")
+    html = html.replace("<i>", "*").replace("</i>", "*")
+    return re.sub(r"<.*?>", "", html)
+
+
+def simplify_polygon(coordinates, tolerance=0.001):
+    """Simplifies a polygon using the Douglas-Peucker algorithm."""
+    polygon = Polygon(coordinates)
+    simplified = polygon.simplify(tolerance, preserve_topology=True)
+    return list(simplified.exterior.coords)
+
+
+def encode_polyline(coordinates):
+    """Encode (lat, lng) pairs with Google's encoded polyline algorithm at 1e-5 degree precision."""
+    result = []
+    prev_lat = prev_lng = 0
+    for lat, lng in coordinates:
+        lat, lng = round(float(lat) * 1e5), round(float(lng) * 1e5)
+        for delta in (lat - prev_lat, lng - prev_lng):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                result.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            result.append(chr(value + 63))
+        prev_lat, prev_lng = lat, lng
+    return "".join(result)
+
+
+def encode_polygon_path(coordinates):
+    """Encode a list of latitude and longitude tuples into a path string for Google Static Maps."""
+    # Encoded polylines use characters such as | and \ that must be escaped inside the URL
+    return "enc:" + quote(encode_polyline(coordinates), safe="?@")
+
+
+def file_mtime(path):
+    """Return the modification time of a file, or None if it does not exist."""
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def load_json(path):
+    """Load a UTF-8 JSON data file."""
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def file_digest(path):
+    """Return the SHA-256 of a file, used to tie the packed file to the JSON it was built from."""
+    with open(path, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def _aligned(offset):
+    return (offset + 7) & ~7
+
+
+class PackedPolygons(Mapping):
+    """Read-only area name -> (N, 2) array of (lat, lng) vertices backed by the packed file."""
+
+    def __init__(self, names, offsets, points):
+        self._index = {name: i for i, name in enumerate(names)}
+        self._offsets = offsets
+        self._points = points
+
+    def __getitem__(self, name):
+        i = self._index[name]
+        return self._points[self._offsets[i]:self._offsets[i + 1]]
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+
+class PackedCoordinates(Mapping):
+    """Read-only area name -> {'lat', 'long', 'en'} backed by the packed file."""
+
+    def __init__(self, names, english_names, values):
+        self._index = {name: i for i, name in enumerate(names)}
+        self._english_names = english_names
+        self._values = values
+
+    def __getitem__(self, name):
+        i = self._index[name]
+        return {'lat': float(self._values[i, 0]), 'long': float(self._values[i, 1]), 'en': self._english_names[i]}
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+
+def pack_geodata(polygon_path, coordinates_path, output_path):
+    """
+    Pack area polygons and coordinates into one binary file.
+
+    Layout: magic and header length, a JSON header with the name tables and source digests, then
+    8-byte aligned arrays: uint32 polygon offsets (one per area plus an end marker), float32
+    polygon vertices as (lat, lng) pairs, and float64 area coordinates as (lat, lng) pairs.
+    """
+    area_to_polygon = load_json(polygon_path)
+    area_to_coordinates = load_json(coordinates_path)
+
+    polygon_names = list(area_to_polygon)
+    offsets = np.zeros(len(polygon_names) + 1, dtype="<u4")
+    for i, name in enumerate(polygon_names):
+        offsets[i + 1] = offsets[i] + len(area_to_polygon[name])
+    points = np.array(
+        [point for name in polygon_names for point in area_to_polygon[name]], dtype="<f4"
+    ).reshape(-1, 2)
+
+    coordinate_names = list(area_to_coordinates)
+    coordinates = np.array(
+        [(area_to_coordinates[name]['lat'], area_to_coordinates[name]['long']) for name in coordinate_names],
+        dtype="<f8"
+    ).reshape(-1, 2)
+
+    header = json.dumps({
+        "polygon_names": polygon_names,
+        "point_count": len(points),
+        "coordinate_names": coordinate_names,
+        "coordinate_english_names": [area_to_coordinates[name].get('en') for name in coordinate_names],
+        "sources": {
+            "area_to_polygon": file_digest(polygon_path),
+            "area_to_coordinates": file_digest(coordinates_path),
+        },
+    }, ensure_ascii=False).encode("utf-8")
+
+    temp_path = f"{output_path}.tmp"
+    with open(temp_path, "wb") as file:
+        file.write(PACKED_HEADER.pack(PACKED_MAGIC, len(header)))
+        file.write(header)
+        for array in (offsets, points, coordinates):
+            file.write(b"\x00" * (_aligned(file.tell()) - file.tell()))
+            file.write(array.tobytes())
+    # Replace atomically so a running bot that has the old file mapped keeps a consistent view
+    os.replace(temp_path, output_path)
+    print(f"Packed {len(polygon_names)} polygons ({len(points)} vertices) and "
+          f"{len(coordinate_names)} coordinates into {output_path}")
+
+
+def load_packed_geodata(path, polygon_path, coordinates_path):
+    """
+    Memory-map a packed geodata file.
+
+    Returns (PackedPolygons, PackedCoordinates), or None if the file is missing or was built from
+    different JSON files than the ones on disk.
+    """
+    try:
+        with open(path, "rb") as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    magic, header_length = PACKED_HEADER.unpack_from(buffer, 0)
+    if magic != PACKED_MAGIC:
+        logging.warning(f"{path} is not a packed geodata file. Loading the JSON files instead.")
+        return None
+    header = json.loads(bytes(buffer[PACKED_HEADER.size:PACKED_HEADER.size + header_length]).decode("utf-8"))
+    sources = header["sources"]
+    if (sources["area_to_polygon"] != file_digest(polygon_path)
+            or sources["area_to_coordinates"] != file_digest(coordinates_path)):
+        logging.warning(f"{path} is out of date with the JSON data files. Loading the JSON files instead; "
+                        f"run geodata.py to rebuild it.")
+        return None
+
+    polygon_names = header["polygon_names"]
+    coordinate_names = header["coordinate_names"]
+    position = _aligned(PACKED_HEADER.size + header_length)
+    offsets = np.frombuffer(buffer, dtype="<u4", count=len(polygon_names) + 1, offset=position)
+    position = _aligned(position + offsets.nbytes)
+    points = np.frombuffer(buffer, dtype="<f4", count=header["point_count"] * 2, offset=position).reshape(-1, 2)
+    position = _aligned(position + points.nbytes)
+    coordinates = np.frombuffer(buffer, dtype="<f8", count=len(coordinate_names) * 2, offset=position).reshape(-1, 2)
+
+    return (
+        PackedPolygons(polygon_names, offsets, points),
+        PackedCoordinates(coordinate_names, header["coordinate_english_names"], coordinates),
+    )
+
+
+class GeoData:
+    """Immutable snapshot of targets, polygons, coordinates and population data."""
+
+    def __init__(self, data_files):
+        self.paths = {
+            'targets': data_files['targets'],
+            'area_to_polygon': data_files['area_to_polygon'],
+            'area_to_coordinates': data_files.get('area_to_coordinates', 'area_to_coordinates.json'),
+            'locality_residents': data_files.get('locality_residents', 'locality_residents.json'),
+            'population_table': data_files.get('population_table', 'population_table.json'),
+            'packed_geometry': data_files.get('packed_geometry', 'area_geometry.bin'),
+        }
+        # Taken before reading so that a file changing mid-load is picked up by the next reload
+        self.mtimes = {name: file_mtime(path) for name, path in self.paths.items()}
+
+        self.locations = load_json(self.paths['targets'])
+        packed = load_packed_geodata(
+            self.paths['packed_geometry'], self.paths['area_to_polygon'], self.paths['area_to_coordinates']
+        )
+        if packed:
+            self.area_to_polygon, self.area_to_coordinates = packed
+        else:
+            self.area_to_polygon = load_json(self.paths['area_to_polygon'])
+            self.area_to_coordinates = load_json(self.paths['area_to_coordinates'])
+        self.locality_data = load_json(self.paths['locality_residents'])
+        self.population_table = load_population_table(
+            self.paths['population_table'], self.locations, self.locality_data
+        )
+        self.city_index = self.build_city_index()
+        self._path_cache = {}  # (area, tolerance) -> encoded path fragment, filled on first use
+        self._bounds_cache = {}  # area -> (min_lat, max_lat, min_lng, max_lng), filled on first use
+        self._merged_cache = OrderedDict()  # (areas, tolerance, merge distance) -> encoded paths, least recent first
+        self._merged_lock = threading.Lock()  # Map URLs are built in worker threads
+        logging.info(f"Loaded geographic data for {len(self.city_index)} cities")
+
+    def changed_files(self):
+        """Return the names of data files modified on disk since this snapshot was loaded."""
+        return [name for name, path in self.paths.items() if file_mtime(path) != self.mtimes[name]]
+
+    def get_coordinates(self, location_name):
+        """Get city coordinates by city name, keyed by name in Google Maps format."""
+        coordinates = {}
+
+        location_name = location_name.strip()
+        if location_name in self.area_to_coordinates:
+            coord = self.area_to_coordinates[location_name]
+            coordinates[location_name] = {
+                'lat': coord['lat'],
+                'lng': coord['long']  # Rename 'long' to 'lng' to match Google Maps API format
+            }
+
+        return coordinates
+
+    def polygon_path(self, area, tolerance=SIMPLIFY_TOLERANCES[0]):
+        """Return the simplified, encoded map path for an area, or None if it has no polygon."""
+        key = (area, tolerance)
+        path = self._path_cache.get(key)
+        if path is None and area in self.area_to_polygon:
+            path = encode_polygon_path(simplify_polygon(self.area_to_polygon[area], tolerance))
+            self._path_cache[key] = path
+        return path
+
+    def area_bounds(self, area):
+        """Return the (min_lat, max_lat, min_lng, max_lng) box around an area, or None if it has no polygon."""
+        bounds = self._bounds_cache.get(area)
+        if bounds is None and area in self.area_to_polygon:
+            points = np.asarray(self.area_to_polygon[area], dtype=float).reshape(-1, 2)
+            if len(points):
+                lats, lngs = points[:, 0], points[:, 1]
+                bounds = (float(lats.min()), float(lats.max()), float(lngs.min()), float(lngs.max()))
+                self._bounds_cache[area] = bounds
+        return bounds
+
+    def map_bounds(self, points, areas):
+        """Return the box around (lat, lng) points and area outlines, or None if there is nothing to frame."""
+        boxes = [bounds for bounds in map(self.area_bounds, areas) if bounds]
+        if points:
+            lats, lngs = zip(*points)
+            boxes.append((min(lats), max(lats), min(lngs), max(lngs)))
+        if not boxes:
+            return None
+        return (
+            min(box[0] for box in boxes), max(box[1] for box in boxes),
+            min(box[2] for box in boxes), max(box[3] for box in boxes),
+        )
+
+    def merged_polygon_paths(self, areas, tolerance=SIMPLIFY_TOLERANCES[-1], merge_distance=0):
+        """
+        Union the polygons of the given areas and return one encoded path per merged outline.
+
+        Areas closer than merge_distance degrees are joined into a single outline. Results are
+        memoized, since every update of a large salvo merges the same areas again.
+        """
+        key = (frozenset(areas), tolerance, merge_distance)
+        with self._merged_lock:
+            paths = self._merged_cache.get(key)
+            if paths is not None:
+                self._merged_cache.move_to_end(key)
+                return paths
+        paths = self._merge_polygons(key[0], tolerance, merge_distance)
+        with self._merged_lock:
+            self._merged_cache[key] = paths
+            while len(self._merged_cache) > MERGED_CACHE_SIZE:
+                self._merged_cache.popitem(last=False)
+        return paths
+
+    def _merge_polygons(self, areas, tolerance, merge_distance):
+        polygons = [Polygon(self.area_to_polygon[area]).buffer(merge_distance)
+                    for area in areas if area in self.area_to_polygon]
+        if not polygons:
+            return []
+        merged = unary_union(polygons)
+        if merge_distance:
+            merged = merged.buffer(-merge_distance)
+        merged = merged.simplify(tolerance, preserve_topology=True)
+        outlines = getattr(merged, "geoms", [merged])
+        return [encode_polygon_path(outline.exterior.coords) for outline in outlines if not outline.is_empty]
+
+    def warm_path_cache(self, tolerance=SIMPLIFY_TOLERANCES[0]):
+        """Simplify and encode every area polygon ahead of the first alert."""
+        for area in self.area_to_polygon:
+            self.polygon_path(area, tolerance)
+
+    def build_city_index(self):
+        """Map each Hebrew city name in targets.json to a ready-made alert record."""
+        city_index = {}
+        for obj in self.locations:
+            city_he = obj["label_he"]
+            if city_he in city_index:
+                continue  # A few names appear more than once; the first entry wins
+            city_index[city_he] = {
+                "english_city": html_to_discord(obj["mixname"]),
+                "migun_time": obj["migun_time"],
+                "coordinates": self.get_coordinates(city_he),
+                "areaid": obj.get("areaid"),
+                "population": self.population_table.get(city_he, {}).get("population", 0),
+            }
+        return city_index
+
+
+if __name__ == "__main__":
+    # Usage: python geodata.py [area_to_polygon.json] [area_to_coordinates.json] [area_geometry.bin]
+    default_paths = ["area_to_polygon.json", "area_to_coordinates.json", "area_geometry.bin"]
+    paths = sys.argv[1:4]
+    pack_geodata(*paths, *default_paths[len(paths):])
@@ -0,0 +1,114 @@
+"""
+Grid-based heatmap engine.
+
+Alert locations are counted in a fixed latitude/longitude grid over Israel and smoothed with a
+separable Gaussian blur. Counts are accumulated per hour as alerts arrive, so the heatmap for a
+long period is the sum of a few hundred small hourly grids instead of a fresh density estimate
+over every alert point.
+"""
+import math
+import time
+from collections import Counter
+
+import numpy as np
+
+from tile_cache import ISRAEL_BOUNDS
+
+CELL_SIZE = 0.01  # Grid resolution in degrees (about 1 km)
+BLUR_SIGMA = 0.02  # Standard deviation of the Gaussian blur in degrees
+HOUR = 3600
+
+MIN_LNG, MAX_LNG, MIN_LAT, MAX_LAT = ISRAEL_BOUNDS
+GRID_COLUMNS = int(round((MAX_LNG - MIN_LNG) / CELL_SIZE))
+GRID_ROWS = int(round((MAX_LAT - MIN_LAT) / CELL_SIZE))
+
+
+def cell_index(lat, lng):
+    """Flat grid index of a location, or None if it falls outside the grid. Row 0 is the south edge."""
+    row = int((lat - MIN_LAT) / CELL_SIZE)
+    column = int((lng - MIN_LNG) / CELL_SIZE)
+    if 0 <= row < GRID_ROWS and 0 <= column < GRID_COLUMNS:
+        return row * GRID_COLUMNS + column
+    return None
+
+
+def entry_location(entry):
+    """Return (lat, lng) of an alert history entry, or None if it has no coordinates."""
+    coord = entry[3].get(entry[1])
+    if not coord or coord.get('lat') is None or coord.get('lng') is None:
+        return None
+    return coord['lat'], coord['lng']
+
+
+def gaussian_blur(grid, sigma=BLUR_SIGMA / CELL_SIZE):
+    """Blur a 2D grid with a Gaussian of `sigma` cells, one axis at a time."""
+    radius = max(1, int(math.ceil(3 * sigma)))
+    offsets = np.arange(-radius, radius + 1)
+    kernel = np.exp(-0.5 * (offsets / sigma) ** 2)
+    kernel /= kernel.sum()
+
+    for axis in (0, 1):
+        pad = [(0, 0), (0, 0)]
+        pad[axis] = (radius, radius)
+        padded = np.pad(grid, pad)
+        length = grid.shape[axis]
+        blurred = np.zeros_like(grid, dtype=np.float32)
+        for weight, offset in zip(kernel, range(2 * radius + 1)):
+            blurred += weight * np.take(padded, np.arange(offset, offset + length), axis=axis)
+        grid = blurred
+    return grid
+
+
+def grid_extent(counts, margin=0.1):
+    """Longitude/latitude extent (minx, maxx, miny, maxy) around the non-empty cells of a grid."""
+    rows, columns = np.nonzero(counts)
+    return (
+        MIN_LNG + columns.min() * CELL_SIZE - margin,
+        MIN_LNG + (columns.max() + 1) * CELL_SIZE + margin,
+        MIN_LAT + rows.min() * CELL_SIZE - margin,
+        MIN_LAT + (rows.max() + 1) * CELL_SIZE + margin,
+    )
+
+
+class HeatmapGrids:
+    """Alert counts per grid cell, accumulated in hourly buckets."""
+
+    def __init__(self, entries=(), retention=None):
+        self.retention = retention  # Seconds hourly buckets are kept, or None to keep them all
+        self._hours = {}  # hour number -> Counter of flat cell index -> alert count
+        self.add(entries)
+
+    def add(self, entries):
+        """Count new alert history entries in their hourly buckets, dropping buckets past the retention."""
+        for entry in entries:
+            location = entry_location(entry)
+            if location is None:
+                continue
+            cell = cell_index(*location)
+            if cell is not None:
+                self._hours.setdefault(int(entry[4] // HOUR), Counter())[cell] += 1
+        if self.retention:
+            cutoff = int((time.time() - self.retention) // HOUR)
+            for hour in [hour for hour in self._hours if hour < cutoff]:
+                del self._hours[hour]
+
+    def counts_since(self, start_time, history):
+        """
+        Return the grid of alert counts from start_time until now.
+
+        Whole hours come from the hourly buckets; the partial hour at the start of the period is
+        counted from the time-sorted history.
+        """
+        grid = np.zeros(GRID_ROWS * GRID_COLUMNS, dtype=np.float32)
+        first_full_hour = int(math.ceil(start_time / HOUR))
+        for hour, cells in self._hours.items():
+            if hour >= first_full_hour:
+                np.add.at(grid, np.fromiter(cells.keys(), dtype=np.int64, count=len(cells)),
+                          np.fromiter(cells.values(), dtype=np.float32, count=len(cells)))
+
+        for entry in history.between(start_time, first_full_hour * HOUR):
+            location = entry_location(entry)
+            cell = cell_index(*location) if location else None
+            if cell is not None:
+                grid[cell] += 1
+        return grid.reshape(GRID_ROWS, GRID_COLUMNS)
@@ -0,0 +1,50 @@
+"""
+Alert ingest, separated from alert processing.
+
+The WebSocket reader only parses frames and puts them in a bounded queue together with the time
+they were received. A consumer task takes them from the queue and processes them, so a slow
+Discord delivery never stops the socket from being read. If the queue is full, the oldest
+waiting alert is dropped: newer alerts carry the more current state. Every drop is logged and
+counted.
+
+Frames are parsed with orjson when it is installed and with the standard json module otherwise.
+"""
+import asyncio
+import json
+import logging
+import time
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+json_loads = orjson.loads if orjson else json.loads  # Both raise a json.JSONDecodeError on bad input
+JSON_BACKEND = "orjson" if orjson else "json"
+
+
+class IngestQueue:
+    """Bounded queue of (received_at, alert data) that drops the oldest entry when full."""
+
+    def __init__(self, maxsize=1000):
+        self._queue = asyncio.Queue(maxsize)
+        self.received = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return self._queue.qsize()
+
+    def put(self, alert_data, received_at=None):
+        """Queue a parsed alert without waiting."""
+        received_at = time.time() if received_at is None else received_at
+        if self._queue.full():
+            _, dropped = self._queue.get_nowait()
+            self.dropped += 1
+            notification_id = dropped.get('data', {}).get('notificationId') if isinstance(dropped, dict) else None
+            logging.error(f"Ingest queue is full; dropped alert {notification_id}")
+        self._queue.put_nowait((received_at, alert_data))
+        self.received += 1
+
+    async def get(self):
+        """Wait for the next alert and return (received_at, alert data)."""
+        return await self._queue.get()
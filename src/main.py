@@ -1,32 +1,46 @@
 import base64
-import io
 import logging
 import random
 import math
-import re
 import sys
 import os
+from collections import Counter
 from PIL import Image
-from matplotlib import pyplot as plt
 from datetime import timedelta, datetime
 from io import BytesIO
-from fuzzywuzzy import process
 from telethon import TelegramClient, events
 import configparser
+import functools
+import hashlib
 import aiofiles
 import aiohttp
-from shapely.geometry import Polygon
 import json
 import time
 import discord
 import asyncio
 from discord.ext import commands
-import seaborn as sns
-import contextily as cx
-import pandas as pd
 from telethon.errors import SessionPasswordNeededError
+from population import match_locality
+from geodata import GeoData, MERGE_DISTANCES, SIMPLIFY_TOLERANCES
+from alert_sources import AlertSources, OrefPoller, WebSocketSource
+from alert_store import AlertHistory, AlertHistoryStore
+from alert_window import AlertWindow
+from map_images import MapImageCache
+from notification_ids import PostedNotifications
+from outbound import ALERT_EDIT, COMMAND_REPLY, CONCLUSION, NEW_ALERT, OutboundQueue, OutboundRejected
+from update_scheduler import UpdateScheduler
+from map_renderer import LocalMapRenderer, bounds_center, bounds_zoom
+from metrics import latency, start_metrics_server
+from tile_cache import DEFAULT_TILE_URL, TileCache, tiles_for_extent, zoom_for_extent
+from charts import ChartCache, RenderPool, RenderRejected, render_bar_chart, render_heatmap
+from heatmap_grid import HeatmapGrids, grid_extent
+from ingest import IngestQueue, JSON_BACKEND
 
 FRONT_COMMAND_ALERT_TITLE = "Israel Home Front Command Alert 🚨"
+MAX_MAP_URL_LENGTH = 8192  # Google Static Maps rejects longer URLs
+MAP_WIDTH, MAP_HEIGHT = 800, 400  # Size of the alert map in pixels
+MAP_PADDING = 40  # Pixels kept free around the alerted area so markers and outlines are not cut off
+MAX_MAP_ZOOM = 12  # Street level; closer zoom levels show too little around a single city
 
 # Load configuration
 with open('config.json') as config_file:
@@ -40,7 +54,15 @@ TOKEN = config['discord_token']
 CHANNEL_IDS = config.get('channel_ids', [])
 GOOGLE_MAPS_API_KEY = config['google_maps_api_key']
 WEBSOCKET_URL = "wss://ws.tzevaadom.co.il:8443/socket?platform=WEB"  # WebSocket URL
+WEBSOCKET_HEADERS = {
+    "Origin": "https://www.tzevaadom.co.il",
+    "Host": "ws.tzevaadom.co.il:8443/socket?platform=WEB",
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/118.0.5993.89 Safari/537.36"
+}
+ALERT_SOURCE_URL = config.get('alert_source_url')  # oref alerts.json, polled alongside the WebSocket when set
+METRICS_PORT = config.get('metrics_port', 9108)  # Local Prometheus endpoint; null disables it
 TEST_MODE = config.get('test_mode', False)  # Ensure default value if not set
+MAP_RENDERER = config.get('map_renderer', 'google')  # 'google' for Static Maps, 'local' to draw maps offline
 DATA_FILES = config['data_files']
 # Telegram API credentials (replace with your own credentials)
 api_id = config['telegram_api_id']
@@ -68,10 +90,35 @@ intents = discord.Intents.default()
 intents.message_content = True
 bot = commands.Bot(command_prefix='!', intents=intents)
 
+# Worker processes for charts, so rendering never blocks alert delivery
+render_pool = RenderPool(
+    workers=config.get('render_workers', 2),
+    max_pending=config.get('render_queue_size', 4),
+    user_cooldown=config.get('render_user_cooldown', 10),
+    timeout=config.get('render_timeout', 60)
+)
+render_pool.start()  # Before any thread is started, see RenderPool.start
+
+# Alert history database, shared by every RedAlert instance
+history_store = AlertHistoryStore(
+    DATA_FILES.get('alert_history', 'alert_history.db'),
+    retention_days=config.get('history_retention_days'),
+    legacy_json_path='alert_history.json'
+)
+
 # Global variables to track alerts and messages
-posted_alert_ids = set()
+red_alert = None  # Shared RedAlert instance, see get_red_alert()
+# Notification ids already posted, kept across restarts so an alert is never posted twice
+posted_alert_ids = PostedNotifications(
+    DATA_FILES.get('posted_alert_ids', 'posted_alert_ids.json'),
+    max_entries=config.get('posted_ids_max_entries', 10000),
+    ttl=config.get('posted_ids_ttl_hours', 24) * 3600
+)
 last_messages = {}  # Dictionary to track last message info per channel
-recent_alerts = []
+recent_alerts = AlertWindow(duration=60)  # Cities listed in the current alert message
+alert_queue = IngestQueue(config.get('ingest_queue_size', 1000))  # Received alerts waiting to be handled
+alert_sources = None  # AlertSources feeding alert_queue, created in on_ready
+oldest_unpublished = None  # Receive time of the oldest alert not yet in a published message
 
 
 async def start_telethon_client():
@@ -125,7 +172,7 @@ async def send_conclusion_message():
         channel = bot.get_channel(channel_id)
         if channel:
             try:
-                await channel.send(embed=embed)
+                await outbound.send(channel.id, CONCLUSION, channel.send, embed=embed)
                 logging.info(f"Sent conclusion message to channel: {channel.name}")
             except Exception as e:
                 logging.error(f"Failed to send conclusion message to channel: {channel.name}. Error: {e}")
@@ -133,11 +180,9 @@ async def send_conclusion_message():
             logging.error(f"Channel ID {channel_id} not found. Skipping conclusion message.")
 
 
-def simplify_polygon(coordinates, tolerance=0.001):
-    """Simplifies a polygon using the Douglas-Peucker algorithm."""
-    polygon = Polygon(coordinates)
-    simplified = polygon.simplify(tolerance, preserve_topology=True)
-    return list(simplified.exterior.coords)
+def map_url_length(url):
+    """Length of a map URL once aiohttp has escaped its | separators."""
+    return len(url) + 2 * url.count("|")
 
 
 def get_city_english_name(city_id):
@@ -150,15 +195,15 @@ def get_city_english_name(city_id):
 
 
 class RedAlert:
-    def __init__(self, session: aiohttp.ClientSession, test_mode=False):
+    def __init__(self, session: aiohttp.ClientSession, test_mode=False, geodata: GeoData = None):
         self.session = session  # Shared aiohttp session
-        self.locations = self.get_locations_list(DATA_FILES['targets'])
-        self.area_to_polygon = self.load_area_to_polygon(DATA_FILES['area_to_polygon'])
-        self.area_to_coordinates = self.load_area_to_coordinates(DATA_FILES['area_to_coordinates'])
+        self.geodata = geodata or GeoData(DATA_FILES)  # Replaced as a whole on reload, never modified
         self.test_mode = test_mode
         self.alert_history = self.load_alert_history()
-        with open('locality_residents.json', 'r') as json_file:
-            self.locality_data = json.load(json_file)
+        # Hourly alert counts for heatmaps, kept as long as the history keeps alerts
+        retention = history_store.retention_days * 86400 if history_store.retention_days else None
+        self.heatmap_grids = HeatmapGrids(self.alert_history, retention)
+        self.unknown_cities = Counter()  # Hebrew names seen in alerts but missing from targets.json
         self.headers = {
             "Host": "ws.tzevaadom.co.il:8443",
             "Connection": "keep-alive",
@@ -181,6 +226,26 @@ class RedAlert:
         # if not self.test_mode:
         #     asyncio.create_task(self.get_cookies())  # Fetch cookies asynchronously only in production
 
+    @property
+    def locations(self):
+        return self.geodata.locations
+
+    @property
+    def area_to_polygon(self):
+        return self.geodata.area_to_polygon
+
+    @property
+    def area_to_coordinates(self):
+        return self.geodata.area_to_coordinates
+
+    @property
+    def locality_data(self):
+        return self.geodata.locality_data
+
+    @property
+    def city_index(self):
+        return self.geodata.city_index
+
     async def get_cookies(self):
         """Retrieve cookies from the server using aiohttp."""
         HOST = "https://www.oref.org.il/"
@@ -196,43 +261,25 @@ class RedAlert:
 
     def find_closest_match(self, query):
         """Find the closest match for a locality and return its population."""
-        localities = list(self.locality_data.keys())
         query = query.split("|")[0].strip()
-        closest_match, score = process.extractOne(query, localities)
-        if score >= 70:  # Threshold for similarity
-            return closest_match, self.locality_data[closest_match]
-        else:
-            logging.warning(f"No close match found for {query}. Similarity Score: {score}")
-            return None, 0
-
-    def calculate_total_population(self, alert_cities):
-        """Calculate the total affected population, counting each city once."""
-        total_population = 0
-        counted_cities = set()
-
-        for city_en, city_he in alert_cities:
-            # Assuming city_en is the English name; adjust if necessary
-            if city_en.lower() not in counted_cities:
-                match, population = self.find_closest_match(city_en)
-                if match:
-                    total_population += population
-                    counted_cities.add(city_en.lower())
-
-        return total_population
+        closest_match, population = match_locality(query, self.locality_data)
+        if closest_match is None:
+            logging.warning(f"No close match found for {query}.")
+        return closest_match, population
+
+    def resolve_city(self, city_he):
+        """Return the alert record for a Hebrew city name, or None if it is unknown."""
+        record = self.city_index.get(city_he)
+        if record is None:
+            if not self.unknown_cities[city_he]:
+                logging.warning(f"Unknown city in alert: {city_he}")
+            self.unknown_cities[city_he] += 1
+            return None
+        return record
 
     def get_coordinates(self, location_names):
         """Get city coordinates by given city names from local JSON."""
-        coordinates = {}
-
-        location_name = location_names.strip()
-        if location_name in self.area_to_coordinates:
-            coord = self.area_to_coordinates[location_name]
-            coordinates[location_name] = {
-                'lat': coord['lat'],
-                'lng': coord['long']  # Rename 'long' to 'lng' to match Google Maps API format
-            }
-
-        return coordinates
+        return self.geodata.get_coordinates(location_names)
 
     def random_coordinates(self, latitude, longitude):
         """Generate random coordinates within a city for visualization."""
@@ -247,135 +294,105 @@ class RedAlert:
         """Count the number of alerts currently active."""
         return len(alerts_data)
 
-    def load_area_to_polygon(self, file_path):
-        """Load area to polygon mappings from a JSON file."""
-        with open(file_path, encoding="utf-8") as file:
-            return json.load(file)
-
-    def load_area_to_coordinates(self, file_path):
-        """Load area to coordinates mappings from a JSON file."""
-        with open(file_path, encoding="utf-8") as file:
-            return json.load(file)
-
-    def get_locations_list(self, file_path):
-        """Build a list of locations and their response times for alerts."""
-        with open(file_path, encoding="utf-8") as file:
-            return json.load(file)
-
-    def encode_polygon_path(self, coordinates):
-        """Encode a list of latitude and longitude tuples into a path string for Google Static Maps."""
-        return "|".join(f"{lat},{lng}" for lat, lng in coordinates)
-
-    # Haversine formula to calculate distance between two points
-    def haversine_distance(self, coord1, coord2):
-        R = 6371000  # Radius of the Earth in meters
-        lat1, lon1 = math.radians(coord1[0]), math.radians(coord1[1])
-        lat2, lon2 = math.radians(coord2[0]), math.radians(coord2[1])
-        dlat = lat2 - lat1
-        dlon = lon2 - lon1
-        a = math.sin(dlat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-        return R * c
-
-    # Function to determine the appropriate zoom level based on maximum distance
-    def calculate_zoom_level(self, max_distance):
-        logging.debug(f"Max distance: {max_distance}")
-        if max_distance < 5000:
-            return 12
-        elif max_distance < 15000:  # City
-            return 11
-        else:  # World
-            return -1
-
     def get_map_url(self, coordinates, hebrew_region, threat):
         """Generate a static map URL with markers and polygon paths."""
         base_url = "https://maps.googleapis.com/maps/api/staticmap"
         markers = []
-        paths = []
         all_coords = []
 
         for region, cities in coordinates.items():
             for city, coord in cities.items():
-                lat = f"{coord['lat']:.6f}"
-                lng = f"{coord['lng']:.6f}"
-                if threat == 5:
-                    markers.append(f"icon:https://i.imgur.com/5VH1kVg.png|{lat},{lng}")
-                elif threat == 0:
-                    markers.append(f"icon:https://i.imgur.com/S3qDKKI.png|{lat},{lng}")
-                elif threat == 2:
-                    markers.append(f"icon:https://i.imgur.com/NVPjahE.png|{lat},{lng}")
-                elif threat == 3:
-                    markers.append(f"icon:https://i.imgur.com/QAvgOIo.png|{lat},{lng}")
-                else:
-                    markers.append(f"color:red|{lat},{lng}")
+                markers.append(f"{round(coord['lat'], 5)},{round(coord['lng'], 5)}")
                 all_coords.append((coord['lat'], coord['lng']))
 
-        for region in hebrew_region:
-            if region in self.area_to_polygon:
-                coordinates = self.area_to_polygon[region]
-                simplified_coordinates = simplify_polygon(coordinates)
-                path = self.encode_polygon_path(simplified_coordinates)
-                if threat == 5:
-                    paths.append(f"fillcolor:0xffa5001a|color:0xffa500ff|weight:2|{path}")
-                else:
-                    paths.append(f"fillcolor:0xff00001a|color:0xff0000ff|weight:2|{path}")
+        # All markers share one style, so they go in a single parameter instead of one per city
+        if threat == 5:
+            marker_style = "icon:https://i.imgur.com/5VH1kVg.png"
+        elif threat == 0:
+            marker_style = "icon:https://i.imgur.com/S3qDKKI.png"
+        elif threat == 2:
+            marker_style = "icon:https://i.imgur.com/NVPjahE.png"
+        elif threat == 3:
+            marker_style = "icon:https://i.imgur.com/QAvgOIo.png"
+        else:
+            marker_style = "color:red"
+        markers_param = f"&markers={marker_style}|" + "|".join(markers) if markers else ""
 
-        markers_param = "&markers=" + "&markers=".join(markers) if markers else ""
-        paths_param = "&path=" + "&path=".join(paths) if paths else ""
+        if threat == 5:
+            path_style = "fillcolor:0xffa5001a|color:0xffa500ff|weight:2"
+        else:
+            path_style = "fillcolor:0xff00001a|color:0xff0000ff|weight:2"
 
         params = {
-            "size": "800x400",
+            "size": f"{MAP_WIDTH}x{MAP_HEIGHT}",
             "maptype": "roadmap",
             "key": GOOGLE_MAPS_API_KEY,
         }
 
-        if len(hebrew_region) == 1:
-            params["zoom"] = 12
-
-        max_distance = 0
-        if len(all_coords) > 1:
-            for i in range(len(all_coords)):
-                for j in range(i + 1, len(all_coords)):
-                    distance = self.haversine_distance(all_coords[i], all_coords[j])
-                    max_distance = max(max_distance, distance)
-
-        zoom_level = self.calculate_zoom_level(max_distance)
-        if zoom_level != -1 and "zoom" not in params:
-            params["zoom"] = zoom_level
-
-        url = f"{base_url}?{'&'.join([f'{k}={v}' for k, v in params.items()])}{markers_param}{paths_param}"
-        if len(url) > 8192:
-            url = f"{base_url}?{'&'.join([f'{k}={v}' for k, v in params.items()])}{markers_param}"
+        # Frame the cities and area outlines from their bounding box, which takes linear time
+        bounds = self.geodata.map_bounds(all_coords, hebrew_region)
+        if bounds:
+            lat, lng = bounds_center(bounds)
+            params["center"] = f"{round(lat, 5)},{round(lng, 5)}"
+            params["zoom"] = bounds_zoom(bounds, MAP_WIDTH, MAP_HEIGHT, MAP_PADDING, max_zoom=MAX_MAP_ZOOM)
+
+        base = f"{base_url}?{'&'.join([f'{k}={v}' for k, v in params.items()])}"
+        url = base + markers_param
+
+        # Use the finest outlines that fit, then merge neighbouring areas, then give up the
+        # city markers before giving up the area outlines
+        for tolerance in SIMPLIFY_TOLERANCES:
+            paths = [self.geodata.polygon_path(region, tolerance) for region in hebrew_region]
+            paths_param = "".join(f"&path={path_style}|{path}" for path in paths if path)
+            if map_url_length(url + paths_param) <= MAX_MAP_URL_LENGTH:
+                return url + paths_param
+
+        merged_params = []
+        for merge_distance in MERGE_DISTANCES:
+            paths = self.geodata.merged_polygon_paths(hebrew_region, SIMPLIFY_TOLERANCES[-1], merge_distance)
+            paths_param = "".join(f"&path={path_style}|{path}" for path in paths)
+            if map_url_length(url + paths_param) <= MAX_MAP_URL_LENGTH:
+                logging.info(f"Merged {len(hebrew_region)} areas into {len(paths)} outlines to fit the map URL.")
+                return url + paths_param
+            merged_params.append(paths_param)
+
+        for paths_param in merged_params:
+            if map_url_length(base + paths_param) <= MAX_MAP_URL_LENGTH:
+                logging.info(f"Dropped city markers to fit outlines for {len(hebrew_region)} areas in the map URL.")
+                return base + paths_param
+
+        logging.warning(f"Area outlines for {len(hebrew_region)} areas do not fit in the map URL. Showing markers only.")
         return url
 
     def load_alert_history(self):
         try:
-            with open('alert_history.json', 'r') as file:
-                return json.load(file)
+            return AlertHistory(history_store.load())
         except Exception as e:
             logging.error(f"Failed to load alert history: {e}")
-            return []
-
-    def save_alert_history(self):
-        try:
-            with open('alert_history.json', 'w') as file:
-                json.dump(self.alert_history, file)
-        except Exception as e:
-            logging.error(f"Failed to save alert history: {e}")
+            return AlertHistory()
 
-    def add_to_alert_history(self, alert):
-        self.alert_history.append(alert)
-        self.save_alert_history()
+    def add_to_alert_history(self, alerts):
+        """Record alerts in memory and queue them for the history database."""
+        self.alert_history.extend(alerts)
+        self.heatmap_grids.add(alerts)
+        history_store.append(alerts)
 
     def get_alert_stats(self, period):
         now = time.time()
         delta = parse_period(period)  # Use the helper function for parsing
         start_time = now - delta.total_seconds()
-        alerts = [alert for alert in self.alert_history if alert[4] >= start_time]
+        return self.alert_history.query(('stats', period), start_time, self._count_city_alerts)
 
+    @staticmethod
+    def _count_city_alerts(alerts):
+        """Group alert times by city."""
         city_alerts = {}
+        time_strings = {}  # Cities in one salvo share a timestamp, so format each one once
         for city, city_he, migun_time, coords, alert_time in alerts:
-            alert_time_str = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(alert_time))
+            alert_time_str = time_strings.get(alert_time)
+            if alert_time_str is None:
+                alert_time_str = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(alert_time))
+                time_strings[alert_time] = alert_time_str
             if city in city_alerts:
                 city_alerts[city].append(alert_time_str)
             else:
@@ -383,46 +400,29 @@ class RedAlert:
 
         return city_alerts
 
-    def get_alerts_within_period(self, period: str):
-        """
-        Retrieve alerts within the specified period.
-
-        Args:
-            period (str): Time period string (e.g., '1h', '2d', '3w').
-
-        Returns:
-            List[dict]: List of alerts with their coordinates and timestamps.
-        """
-        delta = parse_period(period)
-        start_time = time.time() - delta.total_seconds()
-        filtered_alerts = [
-            {
-                "english_city": alert[0],
-                "city_he": alert[1],
-                "migun_time": alert[2],
-                "coordinates": alert[3],
-                "timestamp": alert[4]
-            }
-            for alert in self.alert_history
-            if alert[4] >= start_time
-        ]
-        return filtered_alerts
 
-
-def html_to_discord(html):
-    """Convert HTML to Discord markdown."""
-    html = html.replace("<br>", "\n")
-    html = html.replace("<b>", "**").replace("</b>", "**")
-    html = html.replace("<i>", "*").replace("</i>", "*")
-    return re.sub(r"<.*?>", "", html)
+def get_red_alert():
+    """Return the RedAlert shared by the alert pipeline and all commands, loading it on first use."""
+    global red_alert
+    if red_alert is None:
+        red_alert = RedAlert(session=bot.session, test_mode=TEST_MODE)
+    return red_alert
 
 
 # Initialize a dictionary to hold locks for each channel
 channel_locks = {}
+# Every message and edit goes through one queue that puts alerts first; per-channel order is kept by channel_locks
+outbound = OutboundQueue(
+    concurrency=config.get('delivery_concurrency', 10),
+    max_pending=config.get('outbound_queue_size', 100)
+)
+CHANNEL_SEND_TIMEOUT = config.get('channel_send_timeout', 30)  # Seconds before giving up on one channel
+# Merges alert updates that arrive within one tick, for the alert message and for each channel
+update_scheduler = UpdateScheduler(tick=config.get('update_tick', 1.0))
 
 
-async def send_embed(alert, channel, description, recent_alerts, alert_color, map_url):
-    """Send or update an embed message in a Discord channel."""
+async def send_embed(alert, channel, description, recent_alerts, alert_color, map_image):
+    """Send or update an embed message in a Discord channel, given the map image bytes."""
 
     # Ensure a lock exists for the channel
     if channel.id not in channel_locks:
@@ -433,13 +433,12 @@ async def send_embed(alert, channel, description, recent_alerts, alert_color, ma
         embed = discord.Embed(title=FRONT_COMMAND_ALERT_TITLE, color=alert_color)
         embed.description = description
 
-        # Generate the map image
-        map_image = await fetch_map_image(map_url)
-
         if map_image is None:
-            await channel.send("Failed to download the map image.")
+            await outbound.send(channel.id, NEW_ALERT, channel.send, "Failed to download the map image.")
             return
 
+        map_hash = hashlib.sha256(map_image).digest()
+
         # Check if a message was sent in the last 30 seconds
         current_time = time.time()
         last_message_info = last_messages.get(channel.id)
@@ -448,14 +447,27 @@ async def send_embed(alert, channel, description, recent_alerts, alert_color, ma
             last_alert_category = last_message_info['alert_category']
             logging.info(f"Elapsed time since last message in {channel.name}: {elapsed_time:.2f} seconds")
             if elapsed_time < 30 and last_alert_category == alert_color:
-                # Attempt to edit the existing message
+                # Attempt to edit the existing message, using the handle kept from sending it
                 try:
-                    message = await channel.fetch_message(last_message_info['message_id'])
+                    message = last_message_info['message']
                     embed_copy = embed.copy()
                     embed_copy.set_image(url="attachment://map.png")
-                    await message.edit(embed=embed_copy, attachments=[discord.File(map_image, filename="map.png")])
+                    with latency.timer('edit'):
+                        if last_message_info['map_hash'] == map_hash:
+                            # Same map: the attachment already on the message is kept, only the text changes
+                            message = await outbound.send(channel.id, ALERT_EDIT, message.edit, embed=embed_copy)
+                        else:
+                            message = await outbound.send(
+                                channel.id, ALERT_EDIT, message.edit,
+                                embed=embed_copy, attachments=[discord.File(BytesIO(map_image), filename="map.png")]
+                            )
+                    last_message_info['message'] = message
+                    last_message_info['map_hash'] = map_hash
                     logging.info(f"Updated existing message in {channel.name}")
                     return
+                except OutboundRejected:
+                    logging.warning(f"Dropped an update to the alert message in {channel.name}; the queue is full.")
+                    return
                 except discord.NotFound:
                     logging.warning(f"Last message not found in channel {channel.name}. Sending a new message.")
                 except discord.HTTPException as e:
@@ -464,10 +476,15 @@ async def send_embed(alert, channel, description, recent_alerts, alert_color, ma
         # If no recent message exists, or elapsed time is over 30 seconds, send a new message
         try:
             embed.set_image(url="attachment://map.png")
-            message = await channel.send(embed=embed, file=discord.File(map_image, filename="map.png"))
-            # Update the last_messages dictionary with message ID, timestamp, and alert category
+            with latency.timer('send'):
+                message = await outbound.send(
+                    channel.id, NEW_ALERT, channel.send,
+                    embed=embed, file=discord.File(BytesIO(map_image), filename="map.png")
+                )
+            # Update the last_messages dictionary with the message, timestamp, alert category and map
             last_messages[channel.id] = {
-                'message_id': message.id,
+                'message': message,
+                'map_hash': map_hash,
                 'timestamp': current_time,
                 'alert_category': alert_color  # Store the alert category
             }
@@ -476,19 +493,77 @@ async def send_embed(alert, channel, description, recent_alerts, alert_color, ma
             logging.error(f"Failed to send message in {channel.name}: {e}")
 
 
+async def deliver_to_channel(alert, channel, description, recent_alerts, alert_color, map_image, received_at=None):
+    """Send an alert to one channel, containing its failures and logging how long it took."""
+    start = time.monotonic()
+    try:
+        await asyncio.wait_for(
+            send_embed(alert, channel, description, recent_alerts, alert_color, map_image),
+            timeout=CHANNEL_SEND_TIMEOUT
+        )
+        if received_at is not None:
+            latency.observe('end_to_end', time.time() - received_at)
+        logging.info(f"Delivered alert to {channel.name} in {time.monotonic() - start:.2f} seconds")
+    except asyncio.TimeoutError:
+        logging.error(f"Timed out delivering alert to {channel.name} after {CHANNEL_SEND_TIMEOUT} seconds")
+    except Exception as e:
+        logging.error(f"Failed to deliver alert to {channel.name} after {time.monotonic() - start:.2f} seconds: {e}")
+
+
 async def fetch_map_image(map_url):
-    """Fetch the map image from the provided URL."""
-    async with bot.session.get(map_url) as response:
-        try:
+    """Fetch the map image bytes from the provided URL."""
+    try:
+        async with bot.session.get(map_url) as response:
             if response.status == 200:
-                image_data = await response.read()
-                return BytesIO(image_data)
+                return await response.read()
             else:
                 logging.error(f"Failed to fetch map image. HTTP status: {response.status}")
                 return None
-        except Exception as e:
-            logging.error(f"Exception occurred while fetching map image: {e}")
-            return None
+    except Exception as e:
+        logging.error(f"Exception occurred while fetching map image: {e}")
+        return None
+
+
+# Map images shared across channels and repeated updates; BytesIO wraps the cached bytes without copying
+map_image_cache = MapImageCache(
+    fetch_map_image,
+    max_entries=config.get('map_cache_size', 32),
+    ttl=config.get('map_cache_ttl', 300)
+)
+# Basemap tiles on disk, shared by the heatmap and the local map renderer
+tile_cache = TileCache(
+    config.get('map_tiles_dir', 'map_tiles'),
+    url_template=config.get('tile_url', DEFAULT_TILE_URL),
+    max_bytes=config.get('tile_cache_max_mb', 200) * 1024 * 1024
+)
+local_map_renderer = LocalMapRenderer(tile_cache)
+# Rendered charts, reused until a new alert arrives or old ones age out of the period
+chart_cache = ChartCache(config.get('chart_cache_mb', 32) * 1024 * 1024)
+
+
+async def get_map_image(alert: RedAlert, coordinates, hebrew_region, threat):
+    """Return the map image bytes for an alert from the configured map renderer."""
+    if MAP_RENDERER == 'local':
+        key = f"local:{threat}:{'|'.join(sorted(hebrew_region))}"
+        markers = [(coord['lat'], coord['lng']) for cities in coordinates.values() for coord in cities.values()]
+        with latency.timer('map_render'):
+            return await map_image_cache.get(key, lambda: asyncio.to_thread(
+                local_map_renderer.render, alert.area_to_polygon, hebrew_region, markers, threat
+            ))
+
+    with latency.timer('map_url'):
+        # Merging the outlines of a large salvo takes hundreds of milliseconds; keep it off the event loop
+        map_url = await asyncio.to_thread(alert.get_map_url, coordinates, hebrew_region, threat)
+    with latency.timer('map_fetch'):
+        return await map_image_cache.get(map_url)
+
+
+async def reply(ctx, *args, **kwargs):
+    """Answer a command through the outbound queue, behind alert traffic."""
+    try:
+        return await outbound.send(ctx.channel.id, COMMAND_REPLY, ctx.send, *args, **kwargs)
+    except OutboundRejected:
+        logging.warning(f"Dropped the reply to {ctx.command} in {ctx.channel}; the outbound queue is full.")
 
 
 @bot.command(name='registerAlertsBot')
@@ -502,11 +577,11 @@ async def register_alerts_bot(ctx):
         try:
             with open('config.json', 'w') as config_file:
                 json.dump(config, config_file, indent=4)
-            await ctx.send(f"Alerts bot registered to this channel: {ctx.channel.name}")
+            await reply(ctx, f"Alerts bot registered to this channel: {ctx.channel.name}")
             logging.info(f"Registered channel {ctx.channel.name} for alerts.")
         except Exception as e:
             logging.error(f"Failed to register channel {ctx.channel.name}: {e}")
-            await ctx.send(f"Failed to register this channel due to an error.")
+            await reply(ctx, f"Failed to register this channel due to an error.")
     else:
         # Channel is already registered, remove it instead
         CHANNEL_IDS.remove(ctx.channel.id)
@@ -514,28 +589,36 @@ async def register_alerts_bot(ctx):
         try:
             with open('config.json', 'w') as config_file:
                 json.dump(config, config_file, indent=4)
-            await ctx.send(f"Alerts bot unregistered from this channel: {ctx.channel.name}")
+            await reply(ctx, f"Alerts bot unregistered from this channel: {ctx.channel.name}")
             logging.info(f"Unregistered channel {ctx.channel.name} from alerts.")
         except Exception as e:
             logging.error(f"Failed to unregister channel {ctx.channel.name}: {e}")
-            await ctx.send(f"Failed to unregister this channel due to an error.")
+            await reply(ctx, f"Failed to unregister this channel due to an error.")
 
 
 @bot.command(name='alerts_stats', aliases=['stats', 'alerts'])
 async def alerts_stats(ctx, period: str = "1h"):
     """Display alert statistics for a given period."""
     try:
-        alert = RedAlert(session=bot.session, test_mode=TEST_MODE)
-        stats = alert.get_alert_stats(period)
-        if stats:
+        alert = get_red_alert()
+        start_time = time.time() - parse_period(period).total_seconds()
+        key = ('stats', period, alert.alert_history.generation(start_time))
+        chart = chart_cache.get(key)
+        if chart is None:
+            stats = alert.get_alert_stats(period)
+            if not stats:
+                description = f"**Alert stats for the past {period}:**\n\nNo alerts in the given period."
+                await reply(ctx, description)
+                return
             # Generate a bar chart
-            await generate_bar_chart(ctx, stats, period)
-        else:
-            description = f"**Alert stats for the past {period}:**\n\nNo alerts in the given period."
-            await ctx.send(description)
+            chart = await generate_bar_chart(ctx, stats, period)
+            chart_cache.put(key, chart)
+        await reply(ctx, file=discord.File(BytesIO(chart), filename='alert_stats.png'))
 
     except ValueError as e:
-        await ctx.send(f"Error: {str(e)}. Please use a valid time period format like '1h', '2d', '3w'.")
+        await reply(ctx, f"Error: {str(e)}. Please use a valid time period format like '1h', '2d', '3w'.")
+    except RenderRejected as e:
+        await reply(ctx, str(e))
 
 
 @bot.command(name='reds', aliases=['heatmap'])
@@ -552,45 +635,99 @@ async def alerts_heatmap(ctx, period: str = "1h"):
         /alerts_heatmap 2d
     """
     try:
-        alert = RedAlert(session=bot.session, test_mode=TEST_MODE)
-        alerts = alert.get_alerts_within_period(period)
-        if alerts:
-            await generate_heatmap(ctx, alerts, period)
-        else:
-            await ctx.send(f"No alerts found for the past {period}.")
+        alert = get_red_alert()
+        start_time = time.time() - parse_period(period).total_seconds()
+        key = ('heatmap', period, alert.alert_history.generation(start_time))
+        heatmap = chart_cache.get(key)
+        if heatmap is None:
+            counts = alert.heatmap_grids.counts_since(start_time, alert.alert_history)
+            if not counts.any():
+                await reply(ctx, f"No alerts found for the past {period}.")
+                return
+            heatmap = await generate_heatmap(ctx, counts, period)
+            chart_cache.put(key, heatmap)
+        await reply(ctx, file=discord.File(BytesIO(heatmap), filename='heatmap.png'))
     except ValueError as e:
-        await ctx.send(f"Error: {str(e)}. Please use a valid time period format like '1h', '2d', '3w'.")
+        await reply(ctx, f"Error: {str(e)}. Please use a valid time period format like '1h', '2d', '3w'.")
+    except RenderRejected as e:
+        await reply(ctx, str(e))
 
 
 @bot.command(name='population')
 async def city_population(ctx, *, city_name: str):
     """Fetch the population of a specified city."""
-    alert = RedAlert(session=bot.session, test_mode=TEST_MODE)
+    alert = get_red_alert()
     city, population = alert.find_closest_match(city_name)
     if city:
-        await ctx.send(f"The population of {city} is {population:,} people (as of 2022)")
+        await reply(ctx, f"The population of {city} is {population:,} people (as of 2022)")
     else:
-        await ctx.send(f"Could not find population data for {city_name}.")
+        await reply(ctx, f"Could not find population data for {city_name}.")
 
 
 @bot.command(name='restart')
 @commands.is_owner()
 async def restart(ctx):
     """Restart the bot."""
-    await ctx.send("Restarting the bot...")
+    await reply(ctx, "Restarting the bot...")
+    history_store.close()  # Commit queued history before the process image is replaced
+    posted_alert_ids.snapshot()
     os.execv(sys.executable, ['python'] + sys.argv)
 
 
+@bot.command(name='reload_data')
+@commands.is_owner()
+async def reload_data(ctx):
+    """Reload the data files if any of them changed on disk."""
+    alert = get_red_alert()
+    changed = alert.geodata.changed_files()
+    if not changed:
+        await reply(ctx, "Data files are unchanged. Nothing to reload.")
+        return
+
+    try:
+        # Parse off the event loop; the old snapshot keeps serving alerts until the swap
+        geodata = await asyncio.to_thread(GeoData, DATA_FILES)
+        await asyncio.to_thread(geodata.warm_path_cache)
+        alert.geodata = geodata
+        await reply(ctx, f"Reloaded data files ({', '.join(changed)} changed).")
+        logging.info(f"Reloaded geographic data after changes to: {', '.join(changed)}")
+    except Exception as e:
+        logging.error(f"Failed to reload data files: {e}")
+        await reply(ctx, "Failed to reload data files. Still using the previous data.")
+
+
+@bot.command(name='prewarm_tiles')
+@commands.is_owner()
+async def prewarm_tiles(ctx):
+    """Download the basemap tiles covering Israel at the zoom levels used by heatmaps."""
+    await reply(ctx, "Downloading basemap tiles. This may take a few minutes...")
+    available, total = await tile_cache.prewarm(bot.session)
+    await reply(ctx, f"Tile cache ready: {available} of {total} tiles available.")
+
+
+@bot.command(name='latency')
+@commands.is_owner()
+async def latency_command(ctx):
+    """Show p50/p95/p99 latency of each alert handling stage (owner only)."""
+    rows = latency.summary()
+    if not rows:
+        await reply(ctx, "No alerts have been handled since the bot started.")
+        return
+    lines = [f"{'stage':<11} {'count':>6} {'p50':>9} {'p95':>9} {'p99':>9}"]
+    for stage, count, p50, p95, p99 in rows:
+        lines.append(f"{stage:<11} {count:>6} {p50 * 1000:>7.1f}ms {p95 * 1000:>7.1f}ms {p99 * 1000:>7.1f}ms")
+    await reply(ctx, "```\n" + "\n".join(lines) + "\n```")
+
+
 @bot.command(name='trigger_test_alert')
 @commands.is_owner()
 async def trigger_test_alert(ctx):
     """Manually trigger a test alert (only in test mode)."""
     if not TEST_MODE:
-        await ctx.send("Test mode is not enabled. This command is unavailable.")
+        await reply(ctx, "Test mode is not enabled. This command is unavailable.")
         return
 
-    # Instantiate the RedAlert object first
-    alert = RedAlert(session=bot.session, test_mode=TEST_MODE)
+    alert = get_red_alert()
 
     # Create mock alert data after 'alert' is defined
     mock_alert = {
@@ -603,38 +740,15 @@ async def trigger_test_alert(ctx):
 
     channels = [bot.get_channel(channel_id) for channel_id in CHANNEL_IDS]
     await handle_alert(mock_alert, alert, channels)
-    await ctx.send("Test alert triggered.")
+    await reply(ctx, "Test alert triggered.")
 
 
 async def generate_bar_chart(ctx, stats, period):
-    """Generate and send a bar chart of alert statistics."""
+    """Render a bar chart of alert statistics and return it as PNG bytes."""
     cities = list(stats.keys())
     alert_counts = [len(times) for times in stats.values()]
 
-    plt.figure(figsize=(10, 6), facecolor='#181818')
-    bars = plt.barh(cities, alert_counts, color='#CB0000')  # Dark red bars
-
-    # Add the number of alerts on the bars
-    for bar, count in zip(bars, alert_counts):
-        plt.text(bar.get_width() + 0.1, bar.get_y() + bar.get_height() / 2,
-                 f'{count}', va='center', ha='left', color='red')  # Bright red text
-
-    plt.xlabel('Number of Alerts', color='white')  # White axis label
-    plt.ylabel('Cities', color='white')  # White axis label
-    plt.title(f'Alert Stats for the Past {period}', color='white')  # White title
-    plt.gca().tick_params(axis='both', colors='white')  # White tick labels
-    plt.gca().spines['bottom'].set_color('white')  # White axis line
-    plt.gca().spines['left'].set_color('white')  # White axis line
-    plt.gca().spines['top'].set_color('white')  # White axis line
-    plt.gca().spines['right'].set_color('white')  # White axis line
-    plt.gca().set_facecolor('#181818')  # Set background color to black
-    plt.tight_layout()
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png', facecolor='#181818')  # Save with black background
-    buf.seek(0)
-    file = discord.File(buf, filename='alert_stats.png')
-    await ctx.send(file=file)
-    buf.close()
+    return await render_pool.render(ctx.author.id, render_bar_chart, cities, alert_counts, period)
 
 
 # Helper function to handle time periods
@@ -657,57 +771,44 @@ async def on_ready():
     print(f"Logged in as {bot.user}")
     synced = await bot.tree.sync()
     print(f"Synced {len(synced)} slash commands.")
-    alert = RedAlert(session=bot.session, test_mode=TEST_MODE)
+    alert = get_red_alert()
+    # Simplify and encode area outlines in the background so the first alert finds them cached
+    bot.loop.run_in_executor(None, alert.geodata.warm_path_cache)
     channels = [bot.get_channel(channel_id) for channel_id in CHANNEL_IDS]
+    logging.info(f"Parsing alerts with {JSON_BACKEND}")
+    bot.loop.create_task(process_alerts(alert, channels))
     if TEST_MODE:
         bot.loop.create_task(simulate_alerts(alert, channels))
         print("Bot is running in TEST MODE. Simulating alerts.")
     else:
-        bot.loop.create_task(listen_to_websocket(alert, channels))
+        global alert_sources
+        alert_sources = build_alert_sources(alert.session)
+        bot.loop.create_task(alert_sources.run())
         print("Bot is ready and listening for commands and alerts")
     # Start the Telethon client as a background task
     bot.loop.create_task(start_telethon_client())
 
 
-async def listen_to_websocket(alert: RedAlert, channels):
-    """Listen to the WebSocket for incoming alerts and handle reconnection."""
+async def process_alerts(alert: RedAlert, channels):
+    """Handle alerts from the ingest queue in the order they were received."""
     while True:
+        received_at, alert_data = await alert_queue.get()
         try:
-            async with alert.session.ws_connect(
-                    WEBSOCKET_URL,
-                    headers={
-                        "Origin": "https://www.tzevaadom.co.il",
-                        "Host": "ws.tzevaadom.co.il:8443/socket?platform=WEB",
-                        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/118.0.5993.89 Safari/537.36"
-                    }
-            ) as ws:
-                logging.info("Connected to WebSocket.")
-
-                # Ping the server every 30 seconds to check if connection is still alive
-                while True:
-                    try:
-                        msg = await ws.receive(timeout=120)  # Timeout to detect dead connections
-
-                        if msg.type == aiohttp.WSMsgType.TEXT:
-                            try:
-                                alert_data = json.loads(msg.data)
-                                await handle_alert(alert_data, alert, channels)
-                            except json.JSONDecodeError as e:
-                                logging.error(f"Failed to decode JSON message: {e}")
-                        elif msg.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
-                            logging.error(f"WebSocket closed or error: {msg.type}")
-                            break  # Exit to reconnect
-                    except asyncio.TimeoutError:
-                        # If no message is received in 120 seconds, send a ping to check the connection
-                        await ws.ping()
-                        logging.info("Sent a ping to the WebSocket server.")
-
-        except aiohttp.ClientConnectorError as e:
-            logging.error(f"WebSocket connection error: {e}. Retrying in 5 seconds...")
-            await asyncio.sleep(5)  # Delay before retrying
+            await handle_alert(alert_data, alert, channels, received_at)
         except Exception as e:
-            logging.error(f"Unexpected error with WebSocket: {e}. Retrying in 5 seconds...")
-            await asyncio.sleep(5)
+            logging.error(f"Failed to handle alert {alert_data}: {e}")
+
+
+def build_alert_sources(session: aiohttp.ClientSession):
+    """Create the configured alert sources, all feeding alert_queue."""
+    sources = [WebSocketSource(session, WEBSOCKET_URL, WEBSOCKET_HEADERS)]
+    if ALERT_SOURCE_URL:
+        sources.append(OrefPoller(
+            session, ALERT_SOURCE_URL,
+            min_interval=config.get('oref_poll_min_interval', 1.0),
+            max_interval=config.get('oref_poll_max_interval', 3.0)
+        ))
+    return AlertSources(sources, alert_queue, dedupe_ttl=config.get('source_dedupe_seconds', 60))
 
 
 async def simulate_alerts(alert: RedAlert, channels):
@@ -715,7 +816,7 @@ async def simulate_alerts(alert: RedAlert, channels):
     while True:
         await asyncio.sleep(random.uniform(0, 1))
         mock_alert = generate_mock_alert(alert)
-        await handle_alert(mock_alert, alert, channels)
+        alert_queue.put(mock_alert)
         logging.info("Simulated a test alert.")
 
 
@@ -737,22 +838,42 @@ def generate_mock_alert(alert: RedAlert):
     }
 
 
-async def handle_alert(alert_data, alert: RedAlert, channels):
+async def handle_alert(alert_data, alert: RedAlert, channels, received_at=None):
     """
     Process the alert data received from the WebSocket and send it to Discord channels.
+
+    received_at is when the alert arrived, before it waited in the ingest queue.
     """
-    global recent_alerts
+    global oldest_unpublished
+    received_at = time.time() if received_at is None else received_at
+    queue_delay = time.time() - received_at
+    latency.observe('queue', queue_delay)
+    if queue_delay > 1:
+        logging.warning(f"Alert waited {queue_delay:.2f} seconds in the ingest queue")
     print(f"Received alert data: {alert_data}")
     print(f"recent_alerts: {recent_alerts}")
-    print(f"current time: {time.time()}")
-    recent_alerts = [a for a in recent_alerts if time.time() - a[4] < 60]
+    recent_alerts.expire()
     alert_data = alert_data.get("data", {})
     notification_id = alert_data.get("notificationId")
-    last_alert_category = last_messages.get(channels[0].id, {}).get('alert_category', discord.Colour.default())
-    current_alert_category = alert_categories.get(alert_data.get("threat", 0), (discord.Colour.default(), "Unknown "
-                                                                                                          "Threat"))[0]
-    if last_alert_category != current_alert_category:
-        recent_alerts = []
+    threat = alert_data.get("threat", 0)
+    is_drill = alert_data.get("isDrill", False)
+
+    if is_drill:
+        alert_category = "Drill 🛡️"
+        alert_color = discord.Colour.blue()
+    else:
+        category_info = alert_categories.get(threat, ("Unknown Threat", discord.Colour.default()))
+        alert_category = category_info[1]
+        alert_color = category_info[0]
+
+    # The window is keyed on the colour that is sent, so drills and real alerts are never listed together.
+    # It is checked rather than the last sent message, which may still be on its way
+    if recent_alerts.category != alert_color:
+        # Publish and deliver the cities of the previous category still waiting for the tick before they
+        # are cleared, so every channel gets them, and before the new category's message
+        await update_scheduler.flush('message')
+        await asyncio.gather(*(update_scheduler.flush(channel.id) for channel in channels if channel is not None))
+        recent_alerts.clear(alert_color)
 
     if not notification_id:
         logging.warning("Received alert without notificationId. Skipping.")
@@ -764,60 +885,58 @@ async def handle_alert(alert_data, alert: RedAlert, channels):
     else:
         posted_alert_ids.add(notification_id)
 
-    threat = alert_data.get("threat", 0)
-    is_drill = alert_data.get("isDrill", False)
     cities = alert_data.get("cities", [])
-    timestamp = int(time.time())
+    timestamp = int(received_at)
 
-    if is_drill:
-        alert_category = "Drill 🛡️"
-        alert_color = discord.Colour.blue()
-    else:
-        category_info = alert_categories.get(threat, ("Unknown Threat", discord.Colour.default()))
-        alert_category = category_info[1]
-        alert_color = category_info[0]
-
-    affected_cities = []  # List to store (city_he, city_en)
     new_alerts = []
+    resolve_start = time.perf_counter()
 
     for city_he in cities:
-        for obj in alert.locations:
-            if obj["label_he"] == city_he:
-                migun_time = obj["migun_time"]
-                english_city = html_to_discord(obj["mixname"])
-                coordinates = alert.get_coordinates(city_he)
-                if not coordinates:
-                    logging.warning(f"No coordinates available for {city_he}. Skipping this city.")
-                    continue  # Skip this city if coordinates are missing
-                # check if not already in recent alerts
-                if (english_city, city_he) in [(city_en, city_he) for city_en, city_he, _, _, _ in recent_alerts]:
-                    logging.info(f"City {english_city} already in recent alerts. Skipping.")
-                    continue
-                affected_cities.append((english_city, city_he))
-                new_alerts.append((english_city, city_he, migun_time, coordinates, timestamp))
-                alert.add_to_alert_history((english_city, city_he, migun_time, coordinates, timestamp))
+        record = alert.resolve_city(city_he)
+        if record is None:
+            continue
+        migun_time = record["migun_time"]
+        english_city = record["english_city"]
+        coordinates = record["coordinates"]
+        if not coordinates:
+            logging.warning(f"No coordinates available for {city_he}. Skipping this city.")
+            continue  # Skip this city if coordinates are missing
+        # check if not already in recent alerts
+        if city_he in recent_alerts:
+            logging.info(f"City {english_city} already in recent alerts. Skipping.")
+            continue
+        alert_entry = (english_city, city_he, migun_time, coordinates, timestamp)
+        recent_alerts.add(alert_entry, record["population"] or 0, record["areaid"])
+        new_alerts.append(alert_entry)
+    latency.observe('resolve', time.perf_counter() - resolve_start)
 
     if not new_alerts:
         logging.info("No valid cities found in the alert. Skipping update.")
-        recent_alerts = [a for a in recent_alerts if time.time() - a[4] < 60]  # Clean up recent alerts
         return
 
-    # Clean up recent_alerts to only include alerts within the last 60 seconds
-    recent_alerts = [a for a in recent_alerts if time.time() - a[4] < 60]
-    logging.debug(f"Existing recent alert cities: { {city for _, city in affected_cities} }")
+    alert.add_to_alert_history(new_alerts)
+    logging.debug(f"New recent alert cities: { {city_he for _, city_he, _, _, _ in new_alerts} }")
 
-    # Add new alerts to recent_alerts with the current timestamp
-    for alert_entry in new_alerts:
-        recent_alerts.append(alert_entry)  # Ensure 5 elements
+    # Build and deliver the message from the latest state of the window, merging updates in a burst
+    if oldest_unpublished is None:
+        oldest_unpublished = received_at
+    update_scheduler.submit('message', lambda: publish_alert_update(
+        alert, channels, threat, alert_category, alert_color, timestamp
+    ))
 
-    # Aggregate all affected cities from recent_alerts
-    all_affected_cities = [(city_en, city_he) for city_en, city_he, _, _, _ in recent_alerts]
-    print(all_affected_cities)
-    # Calculate total affected population from all recent alerts
-    total_population = alert.calculate_total_population(all_affected_cities)
+
+async def publish_alert_update(alert: RedAlert, channels, threat, alert_category, alert_color, timestamp):
+    """Build the alert message and map for the cities in recent_alerts and send them to every channel."""
+    global oldest_unpublished
+    received_at = oldest_unpublished or time.time()  # End-to-end latency counts from the oldest merged alert
+    oldest_unpublished = None
+    describe_start = time.perf_counter()
+
+    # The window keeps the total affected population of all recent alerts up to date
+    total_population = recent_alerts.population
 
     # Prepare embed description
-    all_alerts_list = [f"{city_he} ({migun_time}s)" for city_he, _, migun_time, _, _ in recent_alerts]
+    all_alerts_list = recent_alerts.lines()
     all_alerts = "\n• ".join(all_alerts_list)
     all_alerts = f"• {all_alerts}"  # Add the first bullet point manually
     # Define a safe maximum length for the alerts section
@@ -850,127 +969,98 @@ async def handle_alert(alert_data, alert: RedAlert, channels):
             f"-# Time is in your local timezone\n"
             f"-# Israel Time: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))}"
         )
-    # Generate map URL for recent_alerts
-    map_url = alert.get_map_url(
-        {city: alert.get_coordinates(city) for _, city, _, _, _ in recent_alerts},
-        set(city_he for _, city_he, _, _, _ in recent_alerts), threat
+    latency.observe('describe', time.perf_counter() - describe_start)
+
+    # Generate the map for recent_alerts once for every channel
+    map_image = await get_map_image(
+        alert,
+        {city_he: alert.get_coordinates(city_he) for city_he in recent_alerts.areas()},
+        set(recent_alerts.areas()), threat
     )
 
-    # Send embed to all registered channels
+    # Send embed to all registered channels concurrently; a channel still busy with an earlier
+    # update only receives the latest one
     for channel in channels:
         if channel is None:
             logging.warning("One of the channels in CHANNEL_IDS is None. Skipping.")
             continue
-        await send_embed(alert, channel, description, recent_alerts, alert_color, map_url)
+        update_scheduler.submit(channel.id, functools.partial(
+            deliver_to_channel, alert, channel, description, recent_alerts, alert_color, map_image, received_at
+        ))
+    logging.info(f"Published {len(recent_alerts)} cities in {len(recent_alerts.area_counts)} alert areas")
+    stats = update_scheduler.stats()
+    if stats['merged']:
+        logging.info(f"Alert updates: {stats['submitted']} submitted, {stats['merged']} merged into later ones")
 
 
-async def generate_heatmap(ctx, alerts, period):
+async def generate_heatmap(ctx, counts, period):
     """
-    Generate and send a heatmap of alert locations.
+    Render a heatmap of alert locations and return it as PNG bytes.
 
     Args:
         ctx: Discord context.
-        alerts (List[dict]): List of alerts with coordinates.
+        counts (numpy.ndarray): Grid of alert counts from HeatmapGrids.
         period (str): Time period string (e.g., '1h', '2d', '3w').
     """
-    if not alerts:
-        await ctx.send(f"No alert locations found for the past {period}.")
-        return
-
-    # Initialize lists to hold latitude and longitude values
-    lats = []
-    lngs = []
-
-    for alert in alerts:
-        coordinates = alert.get('coordinates', {})
-        city_he = alert.get('city_he')
-
-        if not city_he:
-            logging.warning(f"Alert missing 'city_he': {alert}")
-            continue
-
-        city_coords = coordinates.get(city_he)
-
-        if not city_coords:
-            logging.warning(f"No coordinates found for city '{city_he}' in alert: {alert}")
-            continue
-
-        lat = city_coords.get('lat')
-        lng = city_coords.get('lng')
-
-        if lat is None or lng is None:
-            logging.warning(f"Missing 'lat' or 'lng' for city '{city_he}' in alert: {alert}")
-            continue
-
-        lats.append(lat)
-        lngs.append(lng)
-
-    if not lats or not lngs:
-        await ctx.send(f"No valid alert locations found for the past {period}.")
-        return
-
-    # Create a DataFrame
-    df = pd.DataFrame({
-        'Latitude': lats,
-        'Longitude': lngs
-    })
-
-    # Increase the figure size and DPI for higher resolution
-    plt.figure(figsize=(12, 10), dpi=300)
-
-    # Plot the heatmap with increased resolution and semi-transparency
-    sns.kdeplot(
-        x=df['Longitude'],
-        y=df['Latitude'],
-        cmap="Reds",
-        fill=True,
-        alpha=0.5,  # Adjust this value for desired transparency
-        n_levels=20,  # Increase the number of contour levels for smoother gradients
-        bw_adjust=0.2,
-
-    )
-
-    # Optionally, add a map background
+    # Define the extent of the map and make sure its basemap tiles are cached for the renderer
+    extent = grid_extent(counts)
+    zoom = zoom_for_extent(extent[0], extent[1])
     try:
-        # Define the extent of the map
-        minx, maxx = df['Longitude'].min() - 0.1, df['Longitude'].max() + 0.1
-        miny, maxy = df['Latitude'].min() - 0.1, df['Latitude'].max() + 0.1
-        plt.xlim(minx, maxx)
-        plt.ylim(miny, maxy)
-
-        # Add basemap with higher zoom level
-        cx.add_basemap(
-            plt.gca(),
-            crs="EPSG:4326",
-            source=cx.providers.CartoDB.Voyager,
-        )
+        await tile_cache.fetch_all(bot.session, list(tiles_for_extent(extent, zoom)))
     except Exception as e:
-        logging.warning(f"Failed to add basemap: {e}")
+        logging.warning(f"Failed to download basemap tiles: {e}")
 
-    plt.title(f'Alert Heatmap for the Past {period}', fontsize=16)
-    plt.xlabel('Longitude', fontsize=12, color='white')
-    plt.ylabel('Latitude', fontsize=12, color='white')
+    return await render_pool.render(
+        ctx.author.id, render_heatmap, counts, period, tile_cache.directory, extent, zoom
+    )
 
-    plt.tight_layout()
 
-    # Save the heatmap to a BytesIO object with higher quality
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png', bbox_inches='tight', dpi=300)
-    buf.seek(0)
-    file = discord.File(buf, filename='heatmap.png')
-    await ctx.send(file=file)
-    plt.close()
-    buf.close()
+def metrics_counters():
+    """Counters of the alert pipeline for the metrics endpoint, as (name, labels, value)."""
+    counters = [
+        ("redalert_ingest_received_total", {}, alert_queue.received),
+        ("redalert_ingest_dropped_total", {}, alert_queue.dropped),
+        ("redalert_ingest_queue_length", {}, len(alert_queue)),
+        ("redalert_map_cache_hits_total", {}, map_image_cache.hits),
+        ("redalert_map_cache_misses_total", {}, map_image_cache.misses),
+    ]
+    counters.append(("redalert_window_cities", {}, len(recent_alerts)))
+    counters.append(("redalert_window_areas", {}, len(recent_alerts.area_counts)))
+    update_stats = update_scheduler.stats()
+    for key in ('submitted', 'merged', 'completed', 'failed'):
+        counters.append((f"redalert_updates_{key}_total", {}, update_stats[key]))
+    outbound_stats = outbound.stats()
+    for priority, count in outbound_stats['sent'].items():
+        counters.append(("redalert_outbound_sent_total", {"priority": priority}, count))
+    for priority, count in outbound_stats['shed'].items():
+        counters.append(("redalert_outbound_shed_total", {"priority": priority}, count))
+    counters.append(("redalert_outbound_rate_limited_total", {}, outbound_stats['rate_limited']))
+    if alert_sources:
+        for source, count in alert_sources.first.items():
+            counters.append(("redalert_source_first_total", {"source": source}, count))
+        for source, count in alert_sources.duplicates.items():
+            counters.append(("redalert_source_duplicate_total", {"source": source}, count))
+    return counters
 
 
 async def main():
     """Main entry point for the bot."""
     async with aiohttp.ClientSession() as session:
         bot.session = session  # Attach the session to the bot instance
+        metrics_runner = None
+        if METRICS_PORT:
+            metrics_runner = await start_metrics_server(
+                lambda: latency.render_prometheus(metrics_counters()), port=METRICS_PORT
+            )
         try:
             await bot.start(TOKEN)
         finally:
+            if metrics_runner:
+                await metrics_runner.cleanup()
             await session.close()
+            history_store.close()
+            posted_alert_ids.snapshot()
+            render_pool.shutdown()
 
 
 @bot.event
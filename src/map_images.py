@@ -0,0 +1,68 @@
+"""
+In-memory cache for map images.
+
+An alert update is delivered to every registered channel with the same map, and bursts of
+updates often produce a map that was already downloaded. Images are cached by a hash of their
+URL with LRU and TTL eviction, and concurrent requests for the same URL share a single fetch.
+"""
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+
+
+class MapImageCache:
+    """Content-addressed LRU/TTL cache of map image bytes with single-flight fetching."""
+
+    def __init__(self, fetch, max_entries=32, ttl=300):
+        self._fetch = fetch  # async callable: url -> bytes, or None on failure
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._images = OrderedDict()  # url hash -> (expiry, image bytes)
+        self._in_flight = {}  # url hash -> Future shared by everyone waiting for that image
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(url):
+        """Cache key for a map URL."""
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    async def get(self, url, fetch=None):
+        """
+        Return the image bytes for a map URL, fetching it at most once at a time.
+
+        `fetch` optionally replaces the default fetcher for this call with a no-argument coroutine
+        function, for images that are produced locally rather than downloaded.
+        """
+        key = self.key(url)
+        entry = self._images.get(key)
+        if entry and entry[0] > time.monotonic():
+            self._images.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.hits += 1
+            return await asyncio.shield(future)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        image = None
+        try:
+            image = await fetch() if fetch else await self._fetch(url)
+        except Exception as e:
+            logging.error(f"Exception occurred while fetching map image: {e}")
+        finally:
+            del self._in_flight[key]
+            future.set_result(image)
+
+        if image is not None:
+            self._images[key] = (time.monotonic() + self.ttl, image)
+            self._images.move_to_end(key)
+            while len(self._images) > self.max_entries:
+                self._images.popitem(last=False)
+        return image
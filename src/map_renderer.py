@@ -0,0 +1,155 @@
+"""
+Local map renderer, an offline alternative to Google Static Maps.
+
+Alert areas and city markers are drawn with PIL on top of a basemap assembled from pre-rendered
+256px Web Mercator tiles in the on-disk tile cache. The renderer never downloads tiles; missing
+ones are left as plain background, so it works, and can be tested, without any network access.
+It only picks zoom levels the tile cache prewarms, so a prewarmed cache covers every map.
+"""
+import io
+import logging
+import math
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from tile_cache import HEATMAP_ZOOMS
+
+TILE_SIZE = 256
+MIN_ZOOM, MAX_ZOOM = HEATMAP_ZOOMS[0], HEATMAP_ZOOMS[-1]  # The zoom levels prewarm() downloads
+BACKGROUND_COLOR = (229, 227, 223)
+MAX_CACHED_TILES = 256
+
+# Outline and marker colors per threat, matching the Google Static Maps styles
+AREA_FILL = {5: (255, 165, 0, 26)}
+AREA_OUTLINE = {5: (255, 165, 0, 255)}
+DEFAULT_AREA_FILL = (255, 0, 0, 26)
+DEFAULT_AREA_OUTLINE = (255, 0, 0, 255)
+MARKER_COLORS = {
+    0: (203, 0, 0),
+    2: (139, 0, 0),
+    3: (128, 0, 128),
+    5: (255, 140, 0),
+}
+DEFAULT_MARKER_COLOR = (255, 0, 0)
+
+
+def project(lat, lng, zoom):
+    """Project latitude/longitude arrays to global Web Mercator pixel coordinates at a zoom level."""
+    scale = TILE_SIZE * 2 ** zoom
+    lat = np.radians(np.clip(lat, -85.0511, 85.0511))
+    x = (np.asarray(lng) + 180.0) / 360.0 * scale
+    y = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / math.pi) / 2.0 * scale
+    return x, y
+
+
+def bounds_zoom(bounds, width, height, padding=0, min_zoom=MIN_ZOOM, max_zoom=MAX_ZOOM):
+    """Return the highest zoom level at which a (min_lat, max_lat, min_lng, max_lng) box fits in a padded image."""
+    min_lat, max_lat, min_lng, max_lng = bounds
+    x, y = project(np.array([max_lat, min_lat]), np.array([min_lng, max_lng]), 0)
+    span_x, span_y = x[1] - x[0], y[1] - y[0]  # Size of the box in pixels at zoom 0
+    scales = [(size - 2 * padding) / span for size, span in ((width, span_x), (height, span_y)) if span > 0]
+    if not scales:
+        return max_zoom
+    return max(min_zoom, min(max_zoom, math.floor(math.log2(max(min(scales), 1e-9)))))
+
+
+def bounds_center(bounds):
+    """Return the (lat, lng) at the middle of a (min_lat, max_lat, min_lng, max_lng) box on a Mercator map."""
+    min_lat, max_lat, min_lng, max_lng = bounds
+    _, y = project(np.array([max_lat, min_lat]), np.array([min_lng, max_lng]), 0)
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1.0 - 2.0 * y.mean() / TILE_SIZE))))
+    return lat, (min_lng + max_lng) / 2
+
+
+class LocalMapRenderer:
+    """Draws alert maps to PNG bytes from local basemap tiles."""
+
+    def __init__(self, tiles, size=(800, 400), padding=40):
+        self.tiles = tiles  # Tile source with read(z, x, y) -> PNG bytes or None, e.g. a TileCache
+        self.width, self.height = size
+        self.padding = padding
+        self._tiles = OrderedDict()  # (z, x, y) -> decoded tile image, None when not on disk
+
+    def get_tile(self, z, x, y):
+        """Return a decoded basemap tile, keeping recently used tiles in memory."""
+        key = (z, x, y)
+        if key in self._tiles:
+            self._tiles.move_to_end(key)
+            return self._tiles[key]
+
+        tile = None
+        data = self.tiles.read(z, x, y)
+        if data is not None:
+            try:
+                tile = Image.open(io.BytesIO(data)).convert("RGB")
+            except Exception as e:
+                logging.warning(f"Failed to decode map tile {z}/{x}/{y}: {e}")
+        self._tiles[key] = tile
+        while len(self._tiles) > MAX_CACHED_TILES:
+            self._tiles.popitem(last=False)
+        return tile
+
+    def fit_zoom(self, lats, lngs):
+        """Return the highest zoom level at which all points fit inside the padded image."""
+        return bounds_zoom((lats.min(), lats.max(), lngs.min(), lngs.max()), self.width, self.height, self.padding)
+
+    def frame(self, polygons, markers):
+        """Return the zoom level and the top-left global pixel of a map showing the polygons and markers."""
+        points = np.concatenate(polygons + [markers]) if polygons or len(markers) else np.array([[31.5, 34.9]])
+        zoom = self.fit_zoom(points[:, 0], points[:, 1])
+        x, y = project(points[:, 0], points[:, 1], zoom)
+        return zoom, (x.min() + x.max()) / 2 - self.width / 2, (y.min() + y.max()) / 2 - self.height / 2
+
+    def basemap(self, zoom, left, top):
+        """Assemble the basemap for the image whose top-left global pixel is (left, top)."""
+        image = Image.new("RGB", (self.width, self.height), BACKGROUND_COLOR)
+        tile_count = 2 ** zoom
+        for tile_x in range(int(left // TILE_SIZE), int((left + self.width) // TILE_SIZE) + 1):
+            for tile_y in range(int(top // TILE_SIZE), int((top + self.height) // TILE_SIZE) + 1):
+                if not 0 <= tile_y < tile_count:
+                    continue
+                tile = self.get_tile(zoom, tile_x % tile_count, tile_y)
+                if tile is not None:
+                    image.paste(tile, (int(tile_x * TILE_SIZE - left), int(tile_y * TILE_SIZE - top)))
+        return image
+
+    def render(self, area_to_polygon, areas, markers, threat):
+        """
+        Render an alert map.
+
+        Args:
+            area_to_polygon: Mapping of area name -> sequence of (lat, lng) vertices.
+            areas: Names of the areas to outline.
+            markers: (lat, lng) pairs of the alerted cities.
+            threat: Threat category, used to pick colors.
+
+        Returns:
+            bytes: The map as PNG.
+        """
+        polygons = [np.asarray(area_to_polygon[area], dtype=float) for area in areas if area in area_to_polygon]
+        markers = np.asarray(markers, dtype=float).reshape(-1, 2)
+        zoom, left, top = self.frame(polygons, markers)
+
+        image = self.basemap(zoom, left, top)
+        overlay = Image.new("RGBA", image.size, (0, 0, 0, 0))
+        draw = ImageDraw.Draw(overlay)
+        fill = AREA_FILL.get(threat, DEFAULT_AREA_FILL)
+        outline = AREA_OUTLINE.get(threat, DEFAULT_AREA_OUTLINE)
+        for polygon in polygons:
+            px, py = project(polygon[:, 0], polygon[:, 1], zoom)
+            vertices = list(zip((px - left).tolist(), (py - top).tolist()))
+            if len(vertices) >= 3:
+                draw.polygon(vertices, fill=fill, outline=outline, width=2)
+
+        color = MARKER_COLORS.get(threat, DEFAULT_MARKER_COLOR)
+        if len(markers):
+            mx, my = project(markers[:, 0], markers[:, 1], zoom)
+            for cx, cy in zip((mx - left).tolist(), (my - top).tolist()):
+                draw.ellipse((cx - 5, cy - 5, cx + 5, cy + 5), fill=color + (255,), outline=(255, 255, 255, 255), width=2)
+
+        image.paste(overlay, (0, 0), overlay)
+        buf = io.BytesIO()
+        image.save(buf, format="png", compress_level=1)
+        return buf.getvalue()
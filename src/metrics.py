@@ -0,0 +1,121 @@
+"""
+Latency metrics for the alert pipeline.
+
+Each stage of handling an alert (receiving, parsing, resolving cities, building the map,
+sending to each channel, ...) records its duration in a histogram with fixed buckets, so
+recording is a bisect and an increment. Percentiles are estimated from the buckets. The
+histograms, together with counters from the other components, can be served in the Prometheus
+text format from a small local HTTP endpoint.
+"""
+import bisect
+import logging
+import time
+from contextlib import contextmanager
+
+from aiohttp import web
+
+# Bucket upper bounds in seconds, from half a millisecond to a minute
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    """Counts of observed durations per bucket."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last slot counts durations above every bucket
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def percentile(self, q):
+        """Estimate the q-th percentile (0-100) by interpolating inside its bucket."""
+        if not self.count:
+            return None
+        rank = q / 100 * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class LatencyMetrics:
+    """Histograms of stage durations, created on first use."""
+
+    def __init__(self):
+        self.stages = {}  # stage name -> Histogram
+
+    def observe(self, stage, seconds):
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = self.stages[stage] = Histogram()
+        histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, stage):
+        """Record how long the body of a with block takes."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def summary(self):
+        """Return (stage, count, p50, p95, p99) rows, durations in seconds."""
+        return [
+            (stage, h.count, h.percentile(50), h.percentile(95), h.percentile(99))
+            for stage, h in sorted(self.stages.items())
+        ]
+
+    def render_prometheus(self, counters=()):
+        """
+        Return the histograms, and any extra counters, in the Prometheus text format.
+
+        counters: (name, labels dict, value) tuples, exported as untyped samples.
+        """
+        lines = [
+            "# HELP redalert_stage_latency_seconds Time spent in each stage of handling an alert.",
+            "# TYPE redalert_stage_latency_seconds histogram",
+        ]
+        for stage, h in sorted(self.stages.items()):
+            cumulative = 0
+            for bound, count in zip(h.buckets, h.counts):
+                cumulative += count
+                lines.append(f'redalert_stage_latency_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'redalert_stage_latency_seconds_bucket{{stage="{stage}",le="+Inf"}} {h.count}')
+            lines.append(f'redalert_stage_latency_seconds_sum{{stage="{stage}"}} {h.sum}')
+            lines.append(f'redalert_stage_latency_seconds_count{{stage="{stage}"}} {h.count}')
+        for name, labels, value in counters:
+            label_text = ",".join(f'{key}="{val}"' for key, val in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+latency = LatencyMetrics()  # Shared by every stage of the pipeline
+
+
+async def start_metrics_server(render, host="127.0.0.1", port=9108):
+    """Serve render() at /metrics. Returns the runner to clean up, or None if the port is unavailable."""
+    async def handle(request):
+        return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError as e:
+        logging.error(f"Failed to start the metrics endpoint on {host}:{port}: {e}")
+        await runner.cleanup()
+        return None
+    logging.info(f"Serving metrics at http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,105 @@
+"""
+Record of alert notification ids that were already posted.
+
+The alert feed can deliver the same notification more than once, and the bot may restart in
+the middle of an event. Ids are kept in arrival order with the time they were seen. Ids older
+than the TTL expire, and the oldest are evicted beyond a fixed count, so memory stays flat
+however long the bot runs. The set is snapshotted to a JSON file after every change and
+reloaded on startup, so a restart does not repost alerts.
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class PostedNotifications:
+    """Bounded, persistent set of notification ids with TTL expiry."""
+
+    def __init__(self, path, max_entries=10000, ttl=24 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._ids = OrderedDict()  # notification id -> time it was first seen, oldest first
+        self._dirty = False
+        self._saving = None  # Task writing snapshots in the background
+        self._version = 0  # Bumped on every change
+        self._written = 0  # Version of the snapshot on disk
+        self._write_lock = threading.Lock()  # Background saves and snapshot() share the temp file
+        self.load()
+
+    def __contains__(self, notification_id):
+        self.expire()
+        return notification_id in self._ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    def load(self):
+        """Read the snapshot left by the previous run, if there is one."""
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                entries = json.load(file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logging.error(f"Failed to load posted notification ids from {self.path}: {e}")
+            return
+        for notification_id, seen in entries:
+            self._ids[notification_id] = seen
+        self.expire()
+        logging.info(f"Loaded {len(self._ids)} posted notification ids")
+
+    def expire(self, now=None):
+        """Drop ids older than the TTL and the oldest ids beyond max_entries."""
+        now = time.time() if now is None else now
+        while self._ids and now - next(iter(self._ids.values())) >= self.ttl:
+            self._ids.popitem(last=False)
+        while len(self._ids) > self.max_entries:
+            self._ids.popitem(last=False)
+
+    def add(self, notification_id):
+        """Record a posted notification id and save the set in the background."""
+        self._ids[notification_id] = time.time()
+        self._ids.move_to_end(notification_id)
+        self.expire()
+        self._version += 1
+        self._dirty = True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.snapshot()
+            return
+        if self._saving is None or self._saving.done():
+            self._saving = loop.create_task(self._save())
+
+    async def _save(self):
+        # Ids added while a snapshot is being written are picked up by the next pass
+        while self._dirty:
+            self._dirty = False
+            await asyncio.to_thread(self._write, list(self._ids.items()), self._version)
+
+    def _write(self, entries, version):
+        with self._write_lock:
+            if version < self._written:
+                return  # A newer snapshot was written while this one waited
+            temp_path = f"{self.path}.tmp"
+            try:
+                with open(temp_path, "w", encoding="utf-8") as file:
+                    json.dump(entries, file)
+                os.replace(temp_path, self.path)
+                self._written = version
+            except OSError as e:
+                logging.error(f"Failed to save posted notification ids to {self.path}: {e}")
+
+    def snapshot(self):
+        """Write the set to disk now, e.g. before a restart.
+
+        Waits for a background save that is writing at the same time, so the newer set is the one
+        left on disk.
+        """
+        self._dirty = False
+        self._write(list(self._ids.items()), self._version)
@@ -0,0 +1,209 @@
+"""
+Outbound queue for everything the bot posts to Discord.
+
+Alert embeds, their edits, "incident ended" notices and command replies all compete for the
+same rate limits. Every send or edit goes through one queue that runs the most important work
+first: new alerts, then alert edits, then conclusion notices, then command replies. Each
+channel has a token bucket sized to Discord's per-channel message limit. When Discord reports
+rate-limit headers or a retry delay, the bucket follows them. When the queue backs up, the
+lowest-priority queued work is dropped to make room; new alerts are never dropped.
+"""
+import asyncio
+import itertools
+import logging
+import time
+
+import discord
+
+NEW_ALERT = 0
+ALERT_EDIT = 1
+CONCLUSION = 2
+COMMAND_REPLY = 3
+PRIORITY_NAMES = {NEW_ALERT: "new_alert", ALERT_EDIT: "alert_edit", CONCLUSION: "conclusion", COMMAND_REPLY: "command_reply"}
+
+CHANNEL_BURST = 5  # Discord allows about 5 messages per channel every 5 seconds
+CHANNEL_PERIOD = 5.0
+
+
+class OutboundRejected(Exception):
+    """Raised for a send that was dropped because the outbound queue was full."""
+
+
+class TokenBucket:
+    """Rate limiter for one channel that can be corrected from Discord's rate-limit headers."""
+
+    def __init__(self, capacity=CHANNEL_BURST, period=CHANNEL_PERIOD):
+        self.capacity = capacity
+        self.rate = capacity / period  # Tokens regained per second
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0  # Set when Discord tells us to wait
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """Seconds until a token is available."""
+        self._refill(now)
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def follow_headers(self, headers, now):
+        """Apply X-RateLimit-Remaining and X-RateLimit-Reset-After from a Discord response."""
+        remaining = headers.get("X-RateLimit-Remaining")
+        reset_after = headers.get("X-RateLimit-Reset-After")
+        if remaining is not None:
+            self.tokens = min(self.tokens, float(remaining))
+            self.updated = now
+        if reset_after is not None and remaining is not None and float(remaining) == 0:
+            self.blocked_until = max(self.blocked_until, now + float(reset_after))
+
+    def pause(self, seconds, now):
+        """Stop sending for a while, e.g. after a 429 with a retry delay."""
+        self.tokens = 0.0
+        self.updated = now
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+
+class OutboundJob:
+    """One queued send."""
+
+    __slots__ = ("priority", "seq", "channel_id", "call", "args", "kwargs", "future")
+
+    def __init__(self, priority, seq, channel_id, call, args, kwargs, future):
+        self.priority = priority
+        self.seq = seq
+        self.channel_id = channel_id
+        self.call = call
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future
+
+
+class OutboundQueue:
+    """Priority queue of Discord sends with per-channel token buckets and load shedding."""
+
+    def __init__(self, concurrency=10, max_pending=100):
+        self.concurrency = concurrency  # Sends in flight at once across all channels
+        self.max_pending = max_pending  # Queued sends before lower-priority work is dropped
+        self._jobs = []
+        self._buckets = {}  # channel id -> TokenBucket
+        self._seq = itertools.count()
+        self._in_flight = 0
+        self._running = set()  # Tasks of the sends in flight, referenced until they finish
+        self._wakeup = None
+        self._dispatcher = None
+        self.sent = {priority: 0 for priority in PRIORITY_NAMES}
+        self.shed = {priority: 0 for priority in PRIORITY_NAMES}
+        self.rate_limited = 0
+
+    def bucket(self, channel_id):
+        bucket = self._buckets.get(channel_id)
+        if bucket is None:
+            bucket = self._buckets[channel_id] = TokenBucket()
+        return bucket
+
+    async def send(self, channel_id, priority, call, *args, **kwargs):
+        """Queue `call(*args, **kwargs)`, a Discord coroutine function such as channel.send, and return its result."""
+        loop = asyncio.get_running_loop()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._dispatcher = loop.create_task(self._dispatch())
+
+        if len(self._jobs) >= self.max_pending:
+            # Make room by dropping the newest job of the lowest priority, unless that is this one
+            victim = max(self._jobs, key=lambda job: (job.priority, job.seq))
+            if victim.priority > priority:
+                self._drop(victim)
+            elif priority != NEW_ALERT:
+                self.shed[priority] += 1
+                raise OutboundRejected(f"Outbound queue is full; dropped a {PRIORITY_NAMES[priority]} send.")
+
+        job = OutboundJob(priority, next(self._seq), channel_id, call, args, kwargs, loop.create_future())
+        self._jobs.append(job)
+        self._wakeup.set()
+        return await job.future
+
+    def _drop(self, job):
+        self._jobs.remove(job)
+        self.shed[job.priority] += 1
+        logging.warning(f"Outbound queue is full; dropped a {PRIORITY_NAMES[job.priority]} send "
+                        f"to channel {job.channel_id}")
+        if not job.future.done():
+            job.future.set_exception(OutboundRejected("Outbound queue is full."))
+
+    def _next_job(self, now):
+        """Return the most important job whose channel has a token, or the seconds until one might."""
+        ready = None
+        wait = None
+        for job in self._jobs:
+            if job.future.done():  # The caller gave up, e.g. on a timeout
+                continue
+            delay = self.bucket(job.channel_id).delay(now)
+            if delay <= 0:
+                if ready is None or (job.priority, job.seq) < (ready.priority, ready.seq):
+                    ready = job
+            elif wait is None or delay < wait:
+                wait = delay
+        return ready, wait
+
+    async def _dispatch(self):
+        while True:
+            self._jobs = [job for job in self._jobs if not job.future.done()]
+            job, wait = None, None
+            if self._in_flight < self.concurrency:
+                job, wait = self._next_job(time.monotonic())
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self._jobs.remove(job)
+            self.bucket(job.channel_id).take(time.monotonic())
+            self._in_flight += 1
+            task = asyncio.get_running_loop().create_task(self._run(job))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, job):
+        try:
+            result = await job.call(*job.args, **job.kwargs)
+            self.sent[job.priority] += 1
+            if not job.future.done():
+                job.future.set_result(result)
+        except Exception as e:
+            self._follow_rate_limit(job.channel_id, e)
+            if not job.future.done():
+                job.future.set_exception(e)
+        finally:
+            self._in_flight -= 1
+            self._wakeup.set()
+
+    def _follow_rate_limit(self, channel_id, error):
+        """Slow a channel down as Discord asked, when an error carries rate-limit information."""
+        now = time.monotonic()
+        if isinstance(error, discord.RateLimited):
+            self.rate_limited += 1
+            self.bucket(channel_id).pause(error.retry_after, now)
+        elif isinstance(error, discord.HTTPException) and getattr(error, "response", None) is not None:
+            if error.status == 429:
+                self.rate_limited += 1
+            self.bucket(channel_id).follow_headers(error.response.headers, now)
+
+    def stats(self):
+        """Counters for logging and monitoring."""
+        return {
+            "queued": len(self._jobs),
+            "in_flight": self._in_flight,
+            "sent": {PRIORITY_NAMES[p]: n for p, n in self.sent.items()},
+            "shed": {PRIORITY_NAMES[p]: n for p, n in self.shed.items()},
+            "rate_limited": self.rate_limited,
+        }
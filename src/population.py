@@ -0,0 +1,99 @@
+"""
+Precomputed join between targets.json and locality_residents.json.
+
+Alert cities are matched to census localities with fuzzy string matching, which is far too slow
+to run while an alert is being processed. The matching is done ahead of time by running this
+module as a script, which writes population_table.json keyed by the Hebrew city name (label_he):
+
+    python population.py
+
+At startup the bot loads that table and only fuzzy-matches targets that are missing from it.
+"""
+import json
+import logging
+import re
+import sys
+
+from fuzzywuzzy import process
+
+MATCH_THRESHOLD = 70  # Minimum similarity score to accept a locality match
+
+
+def locality_query(mixname):
+    """Turn a targets.json mixname into the English name used for locality matching."""
+    return re.sub(r"<.*?>", "", mixname).split("|")[0].strip()
+
+
+def match_locality(query, locality_data, localities=None):
+    """Find the closest locality for a query and return (locality, population)."""
+    if localities is None:
+        localities = list(locality_data.keys())
+    closest_match, score = process.extractOne(query, localities)
+    if score >= MATCH_THRESHOLD:
+        return closest_match, locality_data[closest_match]
+    return None, 0
+
+
+def match_targets(targets, locality_data, table=None):
+    """
+    Add a population entry for every target missing from the table.
+
+    Returns:
+        dict: label_he -> {"id", "locality", "population"}.
+    """
+    table = dict(table or {})
+    localities = list(locality_data.keys())
+    for obj in targets:
+        city_he = obj["label_he"]
+        if city_he in table:
+            continue
+        locality, population = match_locality(locality_query(obj["mixname"]), locality_data, localities)
+        table[city_he] = {"id": obj["id"], "locality": locality, "population": population}
+    return table
+
+
+def load_population_table(path, targets, locality_data):
+    """
+    Load the precomputed population table, matching any targets it does not cover yet.
+
+    Unmatched cities are reported once here so that nothing is logged at alert time.
+    """
+    try:
+        with open(path, encoding="utf-8") as file:
+            table = json.load(file)
+    except FileNotFoundError:
+        logging.warning(f"Population table {path} not found. Matching all localities at startup; "
+                        f"run population.py to precompute it.")
+        table = {}
+
+    missing = sum(1 for obj in targets if obj["label_he"] not in table)
+    if missing:
+        logging.info(f"Matching {missing} cities missing from the population table.")
+        table = match_targets(targets, locality_data, table)
+
+    unmatched = sorted(city_he for city_he, entry in table.items() if entry["locality"] is None)
+    if unmatched:
+        logging.warning(f"No population data for {len(unmatched)} cities: {', '.join(unmatched)}")
+    return table
+
+
+def build_population_table(targets_path, residents_path, output_path):
+    """Match every target to a locality and write the result to output_path."""
+    with open(targets_path, encoding="utf-8") as file:
+        targets = json.load(file)
+    with open(residents_path, encoding="utf-8") as file:
+        locality_data = json.load(file)
+
+    table = match_targets(targets, locality_data)
+    with open(output_path, "w", encoding="utf-8") as file:
+        json.dump(table, file, ensure_ascii=False, indent=2, sort_keys=True)
+
+    unmatched = sum(1 for entry in table.values() if entry["locality"] is None)
+    print(f"Wrote {len(table)} cities to {output_path} ({unmatched} without a population match)")
+
+
+if __name__ == "__main__":
+    # Usage: python population.py [targets.json] [locality_residents.json] [population_table.json]
+    default_paths = ["targets.json", "locality_residents.json", "population_table.json"]
+    paths = sys.argv[1:4]
+    build_population_table(*paths, *default_paths[len(paths):])
@@ -0,0 +1,205 @@
+"""
+On-disk cache of basemap tiles.
+
+Tiles are stored as {directory}/{z}/{x}/{y}.png, the layout the local map renderer reads. The
+cache is bounded by total size; the least recently used tiles are deleted first. Tiles covering
+Israel can be downloaded ahead of time so heatmaps render from local files:
+
+    python tile_cache.py [directory] [tile_url]
+
+The tile URL is configurable, so a local tile server can stand in for the real one in tests.
+"""
+import asyncio
+import io
+import logging
+import math
+import os
+import sys
+
+import aiohttp
+import numpy as np
+from PIL import Image
+
+TILE_SIZE = 256
+DEFAULT_TILE_URL = "https://a.basemaps.cartocdn.com/rastertiles/voyager/{z}/{x}/{y}.png"
+ISRAEL_BOUNDS = (34.0, 36.0, 29.3, 33.5)  # min lng, max lng, min lat, max lat, with a margin
+HEATMAP_ZOOMS = range(6, 13)  # Zoom levels chosen for heatmap extents from the whole country down to a city
+MIN_ZOOM, MAX_ZOOM = HEATMAP_ZOOMS[0], HEATMAP_ZOOMS[-1]
+TARGET_WIDTH = 1536  # Approximate basemap width in pixels used to pick a zoom level
+
+
+def tile_x(lng, zoom):
+    """Column of the tile containing a longitude."""
+    return int((lng + 180.0) / 360.0 * 2 ** zoom)
+
+
+def tile_y(lat, zoom):
+    """Row of the tile containing a latitude."""
+    lat = math.radians(lat)
+    return int((1.0 - math.log(math.tan(lat) + 1.0 / math.cos(lat)) / math.pi) / 2.0 * 2 ** zoom)
+
+
+def mercator_y(lat, zoom):
+    """Global Web Mercator pixel row of a latitude (array friendly)."""
+    lat = np.radians(lat)
+    return (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / math.pi) / 2.0 * TILE_SIZE * 2 ** zoom
+
+
+def zoom_for_extent(minx, maxx):
+    """Pick the zoom level at which the extent is roughly TARGET_WIDTH pixels wide."""
+    tiles_wide = TARGET_WIDTH / TILE_SIZE
+    zoom = round(math.log2(tiles_wide * 360.0 / max(maxx - minx, 1e-6)))
+    return max(MIN_ZOOM, min(MAX_ZOOM, zoom))
+
+
+def tiles_for_extent(extent, zoom):
+    """Yield the (z, x, y) of every tile covering an extent given as (minx, maxx, miny, maxy)."""
+    minx, maxx, miny, maxy = extent
+    for x in range(tile_x(minx, zoom), tile_x(maxx, zoom) + 1):
+        for y in range(tile_y(maxy, zoom), tile_y(miny, zoom) + 1):
+            yield zoom, x, y
+
+
+class TileCache:
+    """Size-bounded on-disk tile cache with least-recently-used eviction."""
+
+    def __init__(self, directory, url_template=DEFAULT_TILE_URL, max_bytes=200 * 1024 * 1024):
+        self.directory = directory
+        self.url_template = url_template
+        self.max_bytes = max_bytes
+        self._size = None  # Total bytes on disk, computed on first write
+
+    def path(self, z, x, y):
+        """Location of a tile on disk."""
+        return os.path.join(self.directory, str(z), str(x), f"{y}.png")
+
+    def read(self, z, x, y):
+        """Return a cached tile, or None if it has not been downloaded."""
+        path = self.path(z, x, y)
+        try:
+            with open(path, "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)  # The modification time records the last use for eviction
+        except OSError:
+            pass
+        return data
+
+    def write(self, z, x, y, data):
+        """Store a tile and evict old tiles if the cache grew past its bound."""
+        path = self.path(z, x, y)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as file:
+            file.write(data)
+        os.replace(temp_path, path)
+
+        if self._size is None:
+            self._size = sum(size for _, _, size in self._files())
+        else:
+            self._size += len(data)
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def _files(self):
+        """Yield (path, mtime, size) for every cached tile."""
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith(".png"):
+                    path = os.path.join(root, name)
+                    stat = os.stat(path)
+                    yield path, stat.st_mtime, stat.st_size
+
+    def evict(self):
+        """Delete the least recently used tiles until the cache is at 90% of its bound."""
+        files = sorted(self._files(), key=lambda item: item[1])
+        size = sum(item[2] for item in files)
+        removed = 0
+        for path, _, file_size in files:
+            if size <= self.max_bytes * 0.9:
+                break
+            os.remove(path)
+            size -= file_size
+            removed += 1
+        self._size = size
+        logging.info(f"Evicted {removed} map tiles; the tile cache now holds {size / 1024 / 1024:.1f} MB")
+
+    async def fetch(self, session: aiohttp.ClientSession, z, x, y):
+        """Return a tile from the cache, downloading it if it is missing."""
+        data = await asyncio.to_thread(self.read, z, x, y)
+        if data is not None:
+            return data
+        url = self.url_template.format(z=z, x=x, y=y)
+        try:
+            async with session.get(url, headers={"User-Agent": "RedAlert-Discord-Bot"}) as response:
+                if response.status != 200:
+                    logging.warning(f"Failed to download map tile {z}/{x}/{y}. HTTP status: {response.status}")
+                    return None
+                data = await response.read()
+        except Exception as e:
+            logging.warning(f"Exception occurred while downloading map tile {z}/{x}/{y}: {e}")
+            return None
+        await asyncio.to_thread(self.write, z, x, y, data)
+        return data
+
+    async def fetch_all(self, session: aiohttp.ClientSession, tiles, concurrency=8):
+        """Make sure every tile is cached. Returns the number of tiles available."""
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch_one(tile):
+            async with semaphore:
+                return await self.fetch(session, *tile) is not None
+
+        results = await asyncio.gather(*(fetch_one(tile) for tile in tiles))
+        return sum(results)
+
+    async def prewarm(self, session: aiohttp.ClientSession, extent=ISRAEL_BOUNDS, zooms=HEATMAP_ZOOMS):
+        """Download the tile pyramid covering an extent at the given zoom levels."""
+        tiles = [tile for zoom in zooms for tile in tiles_for_extent(extent, zoom)]
+        available = await self.fetch_all(session, tiles)
+        logging.info(f"Tile cache pre-warmed: {available} of {len(tiles)} tiles available")
+        return available, len(tiles)
+
+    def stitch(self, extent, zoom):
+        """
+        Assemble cached tiles into a basemap for an extent in longitude/latitude.
+
+        Rows are resampled from Web Mercator to evenly spaced latitudes so the image can be drawn
+        with a plain longitude/latitude extent. Missing tiles are left transparent.
+        """
+        minx, maxx, miny, maxy = extent
+        tiles = list(tiles_for_extent(extent, zoom))
+        x0 = min(x for _, x, _ in tiles)
+        y0 = min(y for _, _, y in tiles)
+        width = (max(x for _, x, _ in tiles) - x0 + 1) * TILE_SIZE
+        height = (max(y for _, _, y in tiles) - y0 + 1) * TILE_SIZE
+        mosaic = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+        for z, x, y in tiles:
+            data = self.read(z, x, y)
+            if data is not None:
+                mosaic.paste(Image.open(io.BytesIO(data)).convert("RGBA"), ((x - x0) * TILE_SIZE, (y - y0) * TILE_SIZE))
+        pixels = np.asarray(mosaic)
+
+        scale = TILE_SIZE * 2 ** zoom
+        left = int((minx + 180.0) / 360.0 * scale) - x0 * TILE_SIZE
+        right = int((maxx + 180.0) / 360.0 * scale) - x0 * TILE_SIZE
+        out_height = max(1, int(mercator_y(miny, zoom) - mercator_y(maxy, zoom)))
+        rows = mercator_y(np.linspace(maxy, miny, out_height), zoom) - y0 * TILE_SIZE
+        rows = np.clip(rows.astype(int), 0, height - 1)
+        return pixels[rows, max(left, 0):min(right, width)]
+
+
+async def _prewarm_main(directory, url_template):
+    async with aiohttp.ClientSession() as session:
+        available, total = await TileCache(directory, url_template).prewarm(session)
+    print(f"{available} of {total} tiles cached in {directory}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    asyncio.run(_prewarm_main(
+        sys.argv[1] if len(sys.argv) > 1 else "map_tiles",
+        sys.argv[2] if len(sys.argv) > 2 else DEFAULT_TILE_URL
+    ))
@@ -0,0 +1,76 @@
+"""
+Coalescing of alert updates during a barrage.
+
+Alerts can arrive many times a second, and every update edits the alert message in every
+channel. Most of those edits would be overwritten within moments and only use up Discord rate
+limits. The scheduler keeps at most one pending update per key (the whole alert message, or
+one channel). The first update for a key runs at once. Later ones wait for the next tick, and
+only the latest of them runs; the others are counted as merged.
+"""
+import asyncio
+import logging
+import time
+
+
+class UpdateScheduler:
+    """Runs the latest update per key, at most once per tick."""
+
+    def __init__(self, tick=1.0):
+        self.tick = tick  # Minimum seconds between two updates for the same key
+        self._pending = {}  # key -> coroutine function of the latest update not yet started
+        self._workers = {}  # key -> task running the updates for that key
+        self._last_run = {}  # key -> monotonic time the last update for that key started
+        self.submitted = 0
+        self.merged = 0  # Updates replaced by a newer one before they ran
+        self.completed = 0
+        self.failed = 0
+
+    def submit(self, key, update):
+        """Schedule `update`, a coroutine function without arguments, replacing any pending update for key."""
+        self.submitted += 1
+        if key in self._pending:
+            self.merged += 1
+        self._pending[key] = update
+        worker = self._workers.get(key)
+        if worker is None or worker.done():
+            self._workers[key] = asyncio.get_running_loop().create_task(self._run(key))
+
+    async def _run(self, key):
+        while key in self._pending:
+            delay = self._last_run.get(key, float("-inf")) + self.tick - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)  # Newer updates replace the pending one meanwhile
+            update = self._pending.pop(key, None)
+            if update is not None:  # None if flush() ran it while we waited
+                await self._execute(key, update)
+        del self._workers[key]
+
+    async def _execute(self, key, update):
+        self._last_run[key] = time.monotonic()
+        try:
+            await update()
+            self.completed += 1
+        except Exception as e:
+            self.failed += 1
+            logging.error(f"Alert update for {key} failed: {e}")
+
+    async def flush(self, key):
+        """Run the pending update for key now, without waiting for the tick."""
+        update = self._pending.pop(key, None)
+        if update is not None:
+            await self._execute(key, update)
+
+    async def drain(self):
+        """Wait until every pending update has run."""
+        while self._workers:
+            await asyncio.gather(*list(self._workers.values()), return_exceptions=True)
+
+    def stats(self):
+        """Counters for logging and monitoring."""
+        return {
+            "submitted": self.submitted,
+            "merged": self.merged,
+            "completed": self.completed,
+            "failed": self.failed,
+            "pending": len(self._pending),
+        }